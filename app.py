@@ -1,72 +1,230 @@
 import os
 import json
 import base64
-import io
-from flask import Flask, jsonify, request, send_file, url_for, render_template
+from flask import Flask, jsonify, request, send_file, url_for, render_template, g
 import atexit
 import time
 import string
-import cv2
-from PIL import Image, ExifTags, TiffImagePlugin, ImageOps
+import threading
+from thumbnails import (ThumbnailCache, generate_thumbnail, render_video_thumbnail, probe_video_cached,
+                        thumbnail_name, size_bucket, negotiate_format, is_video, FORMATS, AVIF_AVAILABLE)
+from workpool import CpuPool, PoolBusy, TaskTimeout
+from config import ConfigStore
+from metadata import read_image_metadata
+from catalog import Catalog, SORT_KEYS
+from scanner import FolderScanner
+from warmer import ThumbnailWarmer
+from geocoder import GeocodingWorker, GEOCODERS
+from serving import send_media, set_cache_policy, media_version
+from duplicates import HashIndexer
+from browser import FolderCounter, DirCountCache, list_directory
+from walker import media_type
+from mediaindex import MediaIndex, query as query_index, cursor_of, items_json, columns_json
+from metrics import REGISTRY, REQUEST_SECONDS, REQUESTS, RESPONSE_BYTES, CACHE_LOOKUPS, SlowRequestProfiler
 
 app = Flask(__name__, static_folder='static', template_folder='templates')
 CONFIG_FILE = os.path.join('settings', 'config.json')
 USER_HOME_DIR = os.path.expanduser('~')
-GEO_CACHE_FILE = os.path.join('cache', 'geopy.json')
-GEO_CACHE = {}
-
-def load_geo_cache():
-    """Loads the geolocation cache from a file into memory."""
-    global GEO_CACHE
-    if not os.path.exists('cache'):
-        os.makedirs('cache')
-    if os.path.exists(GEO_CACHE_FILE):
-        with open(GEO_CACHE_FILE, 'r', encoding='utf-8') as f:
-            try:
-                GEO_CACHE = json.load(f)
-            except json.JSONDecodeError:
-                GEO_CACHE = {}
-
-def save_geo_cache():
-    """Saves the in-memory geolocation cache to a file."""
-    with open(GEO_CACHE_FILE, 'w', encoding='utf-8') as f:
-        json.dump(GEO_CACHE, f, indent=4, ensure_ascii=False)
+GEO_CACHE_FILE = os.path.join('cache', 'geopy.json') # Old JSON geocoding cache, imported once
+
+CONFIG_DEFAULTS = {
+    'image_folders': [],
+    'gallery_grid_size': 200,
+    'thumbnail_cache_max_mb': 1024,
+    'scan_interval_seconds': 30,
+    'scan_workers': 8,
+    'pregenerate_thumbnails': True,
+    'pregen_workers': 0,
+    'gallery_sort': 'mtime',
+    'geocoder': 'nominatim',
+    'geocode_interval_seconds': 1.0,
+    'geocode_new_photos': False,
+    'geo_match_radius_m': 50,
+    'server_threads': 16,
+    'cpu_workers': 0,
+    'cpu_queue_limit': 4,
+    'cpu_task_timeout_seconds': 60,
+    'hash_workers': 0,
+    'duplicate_max_distance': 5,
+    'profile_slow_requests': False,
+    'profile_sample_every': 10,
+    'profile_slow_ms': 500,
+    'browse_workers': 16,
+    'browse_count_budget_ms': 300,
+    'browse_count_ttl_seconds': 30
+}
+# Served from memory; the file is only re-read when it changes on disk.
+CONFIG = ConfigStore(CONFIG_FILE, CONFIG_DEFAULTS)
 
 def load_config():
     """Loads configuration, applying default values for missing keys."""
-    defaults = {
-        'image_folders': [],
-        'gallery_grid_size': 200
-    }
-    if not os.path.exists(CONFIG_FILE):
-        return defaults
+    return CONFIG.load()
+
+def configured_folders():
+    """Returns the configured image folders as dicts with at least a 'path' key."""
+    folders = CONFIG.get('image_folders')
+    # Old configs stored bare path strings; get_folders migrates them.
+    return [{'path': f} if isinstance(f, str) else f for f in folders if f and (isinstance(f, str) or f.get('path'))]
+
+def configured_paths():
+    return [f['path'] for f in configured_folders()]
+
+CATALOG = Catalog(scan_workers=load_config()['scan_workers'])
+THUMB_CACHE = ThumbnailCache(max_bytes=load_config()['thumbnail_cache_max_mb'] * 1024 * 1024)
+SCANNER = FolderScanner(CATALOG, configured_folders, interval=load_config()['scan_interval_seconds'])
+
+# Display scales to pre-generate for: gallery.js asks for grid size x devicePixelRatio.
+PREGEN_PIXEL_RATIOS = (1, 2)
+
+def pregen_variants(config):
+    """The thumbnail variants the gallery is most likely to ask for at the configured grid size.
+
+    One per pixel ratio in PREGEN_PIXEL_RATIOS, so HiDPI screens hit the cache too.
+    """
+    fmt = 'avif' if AVIF_AVAILABLE else 'webp'
+    buckets = sorted({size_bucket(config['gallery_grid_size'] * ratio) for ratio in PREGEN_PIXEL_RATIOS})
+    return [(bucket, fmt) for bucket in buckets]
+
+WARMER = ThumbnailWarmer(THUMB_CACHE, pregen_variants(load_config()),
+                         max_workers=load_config()['pregen_workers'] or None, catalog=CATALOG)
+
+CPU_POOL = CpuPool(max_workers=load_config()['cpu_workers'] or None,
+                   queue_limit=load_config()['cpu_queue_limit'],
+                   task_timeout=load_config()['cpu_task_timeout_seconds'])
+
+def store_video_results(path, probe, written):
+    """Records what a worker learned about a video: its probe result and new poster entry."""
+    for name, size in written:
+        THUMB_CACHE.register(name, size)
+    if probe is not None:
+        CATALOG.put_video_info(path, *probe)
+
+def get_video_info(path, st):
+    """Returns a video's VideoInfo from the probe cache, probing the file only on a miss."""
+    info = CATALOG.get_video_info(path, st.st_mtime, st.st_size)
+    CACHE_LOOKUPS.inc(cache='video_info', result='miss' if info is None else 'hit')
+    if info is None:
+        probe, written = CPU_POOL.run(probe_video_cached, path, THUMB_CACHE.cache_dir)
+        store_video_results(path, probe, written)
+        info = probe[2] if probe is not None else None
+    return info
+
+def busy_response():
+    """Backpressure: the CPU pool is full, so ask the client to retry shortly."""
+    return jsonify({'error': 'Server is busy, try again shortly.'}), 503, {'Retry-After': '1'}
+
+def timeout_response():
+    """The file took too long to process (e.g. a decoder hung on a corrupt file)."""
+    return jsonify({'error': 'Processing this file timed out.'}), 504
+
+def warm_changed_media(folder_path, result):
+    """Scanner hook: queues thumbnails for new or modified media in the background."""
+    if CONFIG.get('pregenerate_thumbnails'):
+        WARMER.enqueue(folder_path, CATALOG.get_mtimes(result.added + result.modified))
+
+SCANNER.subscribe(warm_changed_media)
+
+GEOCODER = GeocodingWorker(CATALOG, GEOCODERS.get(load_config()['geocoder'], GEOCODERS['nominatim'])(),
+                           min_interval=load_config()['geocode_interval_seconds'],
+                           match_radius_m=load_config()['geo_match_radius_m'])
+
+def import_geo_cache():
+    """Moves entries from the old JSON geocoding cache into the catalog's place store."""
+    if not os.path.exists(GEO_CACHE_FILE):
+        return
     try:
-        with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
-            user_config = json.load(f)
-        defaults.update(user_config)
-        return defaults
-    except (json.JSONDecodeError, FileNotFoundError):
-        return defaults
-
-def save_config(config):
-    # Ensure the settings directory exists before saving.
-    os.makedirs(os.path.dirname(CONFIG_FILE), exist_ok=True)
-    with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
-        json.dump(config, f, indent=4)
-
-# Load cache at startup and register save on exit
-@app.teardown_appcontext
-def teardown_db(exception):
-    save_geo_cache()
-
-load_geo_cache()
- 
+        with open(GEO_CACHE_FILE, 'r', encoding='utf-8') as f:
+            places = json.load(f)
+    except (json.JSONDecodeError, OSError):
+        places = {}
+    if isinstance(places, dict):
+        CATALOG.import_places(places)
+    os.replace(GEO_CACHE_FILE, GEO_CACHE_FILE + '.imported')
+
+def geocode_changed_media(folder_path, result):
+    """Scanner hook: queues the GPS points of new photos when background geocoding is enabled."""
+    if CONFIG.get('geocode_new_photos'):
+        GEOCODER.enqueue(CATALOG.get_coordinates(result.added + result.modified))
+
+SCANNER.subscribe(geocode_changed_media)
+
+# Media counts for the folder browser; see browse_folders.
+FOLDER_COUNTER = FolderCounter(DirCountCache(ttl=load_config()['browse_count_ttl_seconds']),
+                               max_workers=load_config()['browse_workers'])
+
+HASHER = HashIndexer(CATALOG, max_workers=load_config()['hash_workers'] or None)
+SCANNER.subscribe(HASHER.wake)
+
+# The gallery listing is served from memory; see list_images.
+MEDIA_INDEX = MediaIndex(CATALOG)
+SCANNER.subscribe(MEDIA_INDEX.apply_scan)
+
+def load_caches():
+    """Loads what the first requests would otherwise wait for; runs in the background at startup."""
+    try:
+        import_geo_cache()
+        MEDIA_INDEX.load()
+        THUMB_CACHE.load()
+    except Exception:
+        app.logger.exception('Loading caches failed')
+
+def start_background_services():
+    """Starts the background folder scanner, geocoder and hash indexer; called once before serving."""
+    # Requests are accepted right away; the caches fill in meanwhile (or on first use).
+    threading.Thread(target=load_caches, name='load-caches', daemon=True).start()
+    if not SCANNER.is_alive():
+        SCANNER.start()
+    if not GEOCODER.is_alive():
+        GEOCODER.start()
+    if not HASHER.is_alive():
+        HASHER.start()
+
+PROFILER = SlowRequestProfiler(os.path.join('cache', 'profiles'))
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    # Opt-in: profile a sample of requests and keep the stats of slow ones.
+    if CONFIG.get('profile_slow_requests'):
+        g.profiler = PROFILER.start(CONFIG.get('profile_sample_every'))
+
+def count_streamed_bytes(chunks, source, endpoint):
+    """Passes a streamed body through, adding its size to RESPONSE_BYTES once it ends or is cut off."""
+    sent = 0
+    try:
+        for chunk in chunks:
+            sent += len(chunk)
+            yield chunk
+    finally:
+        RESPONSE_BYTES.inc(sent, endpoint=endpoint)
+        if hasattr(source, 'close'):
+            source.close()
+
 @app.after_request
 def log_request(response):
-    """Log each request's method, path, and status code."""
-    app.logger.info(f'{request.method} {request.path} {response.status}')
+    """Logs each request's method, path, status and duration, and records it in the metrics."""
+    elapsed = time.perf_counter() - g.get('request_started', time.perf_counter())
+    endpoint = request.endpoint or 'unmatched' # Route names keep the label set small
+    REQUEST_SECONDS.observe(elapsed, endpoint=endpoint, method=request.method)
+    REQUESTS.inc(endpoint=endpoint, method=request.method, status=str(response.status_code))
+    if response.content_length:
+        RESPONSE_BYTES.inc(response.content_length, endpoint=endpoint)
+    elif response.is_streamed and not response.direct_passthrough:
+        # Streamed listings have no Content-Length: count the chunks as they go out.
+        response.response = count_streamed_bytes(response.iter_encoded(), response.response, endpoint)
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        PROFILER.finish(profiler, elapsed, CONFIG.get('profile_slow_ms'), f'{request.method} {request.path}')
+    app.logger.info(f'{request.method} {request.path} {response.status} {elapsed * 1000:.1f}ms')
     return response
 
+@app.teardown_request
+def stop_profiler(exc):
+    """Makes sure a profiler is switched off even if the request failed before after_request."""
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        PROFILER.finish(profiler, 0, float('inf'), request.path)
+
 @app.route('/')
 @app.route('/index.html')
 def index():
@@ -76,9 +234,32 @@ def index():
 def gallery():
     return render_template('gallery.html')
 
+def folder_counts(dir_paths):
+    """Media counts for subfolders: the catalog's for indexed ones, else counted within the time budget.
+
+    Returns {dir_path: {'image': n, 'video': m}, or None while still counting}.
+    """
+    counts = CATALOG.dir_counts(dir_paths)
+    remaining = [path for path in dir_paths if path not in counts]
+    if remaining:
+        counts.update(FOLDER_COUNTER.counts(remaining, CONFIG.get('browse_count_budget_ms') / 1000))
+    return counts
+
+def folder_entry(name, counts):
+    if counts is None:
+        # Still being counted; the client fetches it from /api/browse/counts.
+        return {'name': name, 'image_count': None, 'video_count': None, 'pending': True}
+    return {'name': name, 'image_count': counts['image'], 'video_count': counts['video']}
+
 @app.route('/api/browse', methods=['POST'])
 def browse_folders():
-    """Provides a list of subdirectories for a given path."""
+    """Provides a list of subdirectories for a given path.
+
+    The directory is read with a single scandir pass. Subfolder media counts
+    come from the catalog or the count cache, or are counted concurrently;
+    folders not counted within browse_count_budget_ms are returned with
+    'pending': True and can be fetched from /api/browse/counts.
+    """
     data = request.get_json()
     req_path = data.get('path')
     show_hidden = data.get('show_hidden', False)
@@ -99,27 +280,10 @@ def browse_folders():
         if not os.path.isdir(safe_path):
             raise ValueError("Path is not a valid directory.")
 
-        dirs = []
-        files = []
-        IMAGE_EXTS = ('.png', '.jpg', '.jpeg', '.gif', '.webp', '.bmp')
-        VIDEO_EXTS = ('.mp4', '.webm', '.mov', '.avi', '.mkv')
-        MEDIA_EXTS = IMAGE_EXTS + VIDEO_EXTS
-
-        for item in os.listdir(safe_path):
-            if not show_hidden and (item.startswith('.') or item.startswith('$')):
-                continue
-
-            item_path = os.path.join(safe_path, item)
-            if os.path.isdir(item_path):
-                try:
-                    files_in_subdir = os.listdir(item_path)
-                    image_count = len([f for f in files_in_subdir if f.lower().endswith(IMAGE_EXTS)])
-                    video_count = len([f for f in files_in_subdir if f.lower().endswith(VIDEO_EXTS)])
-                    dirs.append({'name': item, 'image_count': image_count, 'video_count': video_count})
-                except OSError:
-                    dirs.append({'name': item, 'image_count': -1, 'video_count': -1}) # Indicate inaccessible folder
-            elif item.lower().endswith(MEDIA_EXTS):
-                files.append(item)
+        dir_names, files = list_directory(safe_path, show_hidden)
+        dir_names.sort()
+        counts = folder_counts([os.path.join(safe_path, name) for name in dir_names])
+        dirs = [folder_entry(name, counts.get(os.path.join(safe_path, name))) for name in dir_names]
 
         parent_dir = os.path.dirname(safe_path)
         # Check if the parent is a drive root (e.g., 'C:\')
@@ -129,20 +293,39 @@ def browse_folders():
         parent_path = parent_dir if not is_root else None
 
         # Count media files in the current directory from the 'files' list
-        current_image_count = len([f for f in files if f.lower().endswith(IMAGE_EXTS)])
-        current_video_count = len([f for f in files if f.lower().endswith(VIDEO_EXTS)])
+        current_video_count = sum(1 for f in files if media_type(f) == 'video')
 
         return jsonify({
             'current_path': safe_path,
             'parent_path': parent_path,
-            'directories': sorted(dirs, key=lambda d: d['name']),
+            'directories': dirs,
             'files': sorted(files),
-            'current_image_count': current_image_count,
-            'current_video_count': current_video_count
+            'current_image_count': len(files) - current_video_count,
+            'current_video_count': current_video_count,
+            'pending_count': sum(1 for d in dirs if d.get('pending'))
         })
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/browse/counts', methods=['POST'])
+def browse_counts():
+    """Returns media counts for some subfolders of a directory, e.g. the ones /api/browse left pending.
+
+    Takes {'path': parent, 'names': [subfolder, ...]}; anything still not
+    counted after the time budget comes back pending again.
+    """
+    data = request.get_json() or {}
+    parent = data.get('path')
+    names = data.get('names')
+    if not parent or not isinstance(names, list) or not all(isinstance(n, str) for n in names):
+        return jsonify({'error': 'Expected a path and a list of subfolder names.'}), 400
+    # Only direct children, so this can't be used to probe arbitrary paths.
+    names = [n for n in names if n and os.path.basename(n) == n and n not in ('.', '..')]
+    parent = os.path.abspath(parent)
+    counts = folder_counts([os.path.join(parent, name) for name in names])
+    dirs = [folder_entry(name, counts.get(os.path.join(parent, name))) for name in names]
+    return jsonify({'path': parent, 'directories': dirs, 'pending_count': sum(1 for d in dirs if d.get('pending'))})
+
 @app.route('/api/drives')
 def get_drives():
     """Returns a list of available system drives."""
@@ -151,29 +334,24 @@ def get_drives():
 
 @app.route('/api/folders')
 def get_folders():
-    config = load_config()
     folder_data = []
-    image_folders = config.get('image_folders', [])
+    image_folders = CONFIG.get('image_folders')
 
     # --- Migration for old config format ---
-    migrated = False
-    for i, folder in enumerate(image_folders):
-        if isinstance(folder, str):
-            image_folders[i] = {'path': folder, 'added_on': time.time()}
-            migrated = True
-    if migrated:
-        config['image_folders'] = image_folders
-        save_config(config)
+    if any(isinstance(folder, str) for folder in image_folders):
+        with CONFIG.edit() as config:
+            for i, folder in enumerate(config['image_folders']):
+                if isinstance(folder, str):
+                    config['image_folders'][i] = {'path': folder, 'added_on': time.time()}
+            image_folders = config['image_folders']
     # --- End Migration ---
 
+    media_counts = CATALOG.folder_counts()
     for folder_info in image_folders:
         folder_path = folder_info.get('path')
-        try:
-            if os.path.isdir(folder_path):
-                media_extensions = ('.png', '.jpg', '.jpeg', '.gif', '.webp', '.bmp', '.mp4', '.webm', '.mov', '.avi', '.mkv')
-                media_count = len([f for f in os.listdir(folder_path) if f.lower().endswith(media_extensions)])
-                folder_data.append({'path': folder_path, 'media_count': media_count, 'added_on': folder_info.get('added_on')})
-        except Exception: pass
+        if folder_path and os.path.isdir(folder_path):
+            folder_data.append({'path': folder_path, 'media_count': media_counts.get(folder_path, 0), 'added_on': folder_info.get('added_on'),
+                                'recursive': folder_info.get('recursive', False), 'scanned': CATALOG.is_scanned(folder_path)})
     return jsonify(folder_data)
 
 @app.route('/api/settings', methods=['GET', 'POST'])
@@ -181,9 +359,10 @@ def handle_settings():
     """Handles getting and saving application settings."""
     if request.method == 'POST':
         data = request.get_json()
-        config = load_config()
-        config.update(data)
-        save_config(config)
+        with CONFIG.edit() as config:
+            config.update(data)
+        THUMB_CACHE.set_max_bytes(config['thumbnail_cache_max_mb'] * 1024 * 1024)
+        WARMER.variants = pregen_variants(config)
         return jsonify({'success': True})
     else: # GET
         return jsonify(load_config())
@@ -194,11 +373,27 @@ def add_folder():
     folder_path = data.get('path')
     if not folder_path or not os.path.isdir(folder_path):
         return jsonify({'success': False, 'error': 'Invalid or non-existent path.'}), 400
-    config = load_config()
-    # Check if path already exists
-    if not any(f.get('path') == folder_path for f in config['image_folders']):
-        config['image_folders'].append({'path': folder_path, 'added_on': time.time()})
-        save_config(config)
+    # Optional recursive indexing: walk subfolders down to max_depth, skipping exclude globs.
+    options = {}
+    if 'recursive' in data:
+        options['recursive'] = bool(data['recursive'])
+    if 'max_depth' in data:
+        if data['max_depth'] is not None and (not isinstance(data['max_depth'], int) or data['max_depth'] < 0):
+            return jsonify({'success': False, 'error': 'max_depth must be a non-negative integer.'}), 400
+        options['max_depth'] = data['max_depth']
+    if 'exclude' in data:
+        if not isinstance(data['exclude'], list) or not all(isinstance(p, str) for p in data['exclude']):
+            return jsonify({'success': False, 'error': 'exclude must be a list of patterns.'}), 400
+        options['exclude'] = data['exclude']
+    with CONFIG.edit() as config:
+        # Check if path already exists
+        existing = next((f for f in config['image_folders'] if f.get('path') == folder_path), None)
+        if existing is None:
+            config['image_folders'].append({'path': folder_path, 'added_on': time.time(), **options})
+        else:
+            existing.update(options)
+    # Indexing a large folder can take a while; the scanner does it in the background.
+    SCANNER.request_scan(folder_path)
     return jsonify({'success': True, 'path': folder_path})
 
 @app.route('/api/delete_folder', methods=['POST'])
@@ -207,124 +402,181 @@ def delete_folder():
     folder_path = data.get('path')
     if not folder_path:
         return jsonify({'success': False, 'error': 'Path is required.'}), 400
-    config = load_config()
-    # Rebuild the list excluding the folder to be deleted
-    config['image_folders'] = [f for f in config['image_folders'] if f.get('path') != folder_path]
-    save_config(config)
+    with CONFIG.edit() as config:
+        # Rebuild the list excluding the folder to be deleted
+        config['image_folders'] = [f for f in config['image_folders'] if f.get('path') != folder_path]
+    WARMER.cancel_folder(folder_path)
+    CATALOG.remove_folder(folder_path)
+    MEDIA_INDEX.remove_folder(folder_path)
+    HASHER.invalidate()
     return jsonify({'success': True})
 
+def media_item(full_path, filename, mtime, media_type, taken, size):
+    """Builds the JSON object the gallery expects for one catalog row."""
+    encoded_path = base64.urlsafe_b64encode(full_path.encode()).decode()
+    return {
+        # Versioned by mtime and size, so the browser may cache it for good.
+        'src': f'/image/{encoded_path}?v={media_version(mtime, size)}',
+        'filename': filename,
+        'encoded_path': encoded_path,
+        'mtime': mtime,
+        'taken': taken,
+        'type': media_type
+    }
+
+def encode_cursor(mtime, path):
+    return base64.urlsafe_b64encode(json.dumps([mtime, path]).encode()).decode()
+
+def decode_cursor(cursor):
+    mtime, path = json.loads(base64.urlsafe_b64decode(cursor))
+    return float(mtime), str(path)
+
 @app.route('/api/images')
 def list_images():
-    config = load_config()
-    all_images = []
-    for folder_info in config.get('image_folders', []):
-        try:
-            folder_path = folder_info.get('path')
-            if not folder_path:
-                continue
-
-            if os.path.isdir(folder_path):
-                for filename in os.listdir(folder_path):
-                    # Skip hidden/system files (like ._ files from macOS)
-                    if filename.startswith('.') or filename.startswith('$'):
-                        continue
-
-                    IMAGE_EXTS = ('.png', '.jpg', '.jpeg', '.gif', '.webp', '.bmp')
-                    VIDEO_EXTS = ('.mp4', '.webm', '.mov', '.avi', '.mkv')
-                    
-                    file_lower = filename.lower()
-                    if file_lower.endswith(IMAGE_EXTS) or file_lower.endswith(VIDEO_EXTS):
-                        try:
-                            full_path = os.path.join(folder_path, filename)
-                            encoded_path = base64.urlsafe_b64encode(full_path.encode()).decode()
-                            
-                            img_data = {
-                                'src': f'/image/{encoded_path}',
-                                'filename': filename,
-                                'encoded_path': encoded_path,
-                                'mtime': os.path.getmtime(full_path),
-                                'type': 'image' if file_lower.endswith(IMAGE_EXTS) else 'video'
-                            }
-                            all_images.append(img_data)
-                        except Exception:
-                            continue # Skip files that can't be processed
-        except Exception: continue
-    
-    # Sort images by modification time, newest first
-    all_images.sort(key=lambda x: x.get('mtime', 0), reverse=True)
-    
-    return jsonify(all_images)
+    """Lists cataloged media, optionally paginated, filtered and streamed.
+
+    Query parameters:
+      limit     page size; when given the response is {'items', 'next_cursor'}
+      cursor    the next_cursor of the previous page
+      type      'image' or 'video'
+      folder    restrict to one configured collection
+      sort      'mtime' (default) or 'taken' for EXIF capture time
+      since, until  range of the sort key as Unix timestamps
+      order     'desc' (newest first, default) or 'asc'
+      format    'json' (default), 'ndjson' to stream one item per line, or
+                'columns' for one array per field (see mediaindex.columns_json)
+    """
+    try:
+        limit = request.args.get('limit', type=int)
+        after = decode_cursor(request.args['cursor']) if request.args.get('cursor') else None
+        since = request.args.get('since', type=float)
+        until = request.args.get('until', type=float)
+    except (ValueError, TypeError):
+        return jsonify({'error': 'Invalid query parameters.'}), 400
+    if limit is not None and limit <= 0:
+        return jsonify({'error': 'limit must be a positive integer.'}), 400
+    media_type = request.args.get('type')
+    sort = request.args.get('sort', 'mtime')
+    if sort not in SORT_KEYS:
+        return jsonify({'error': f"sort must be one of: {', '.join(SORT_KEYS)}."}), 400
+    descending = request.args.get('order', 'desc') != 'asc'
+    folder_filter = request.args.get('folder')
+    output = request.args.get('format', 'json')
+
+    # The scanner keeps the index current, so no disk or database access here.
+    folders = [f for f in configured_paths() if not folder_filter or f == folder_filter]
+    snap = MEDIA_INDEX.snapshot()
+    # Fetch one extra row to learn whether another page follows.
+    ids = query_index(snap, folders, media_type=media_type, since=since, until=until, after=after,
+                      descending=descending, limit=limit + 1 if limit else None, sort=sort)
+    next_cursor = None
+    if limit and len(ids) > limit:
+        ids = ids[:limit]
+        next_cursor = encode_cursor(*cursor_of(snap, ids[-1], sort))
+
+    if output == 'columns':
+        return app.response_class(columns_json(snap, ids, next_cursor), mimetype='application/json')
+
+    if output == 'ndjson':
+        def generate():
+            for start in range(0, len(ids), 1000):
+                yield ''.join(item + '\n' for item in items_json(snap, ids[start:start + 1000]))
+            if next_cursor:
+                yield json.dumps({'next_cursor': next_cursor}) + '\n'
+        return app.response_class(generate(), mimetype='application/x-ndjson')
+
+    if not limit:
+        # A whole-library listing: streamed in chunks so it is never held in memory at once.
+        def generate():
+            for start in range(0, len(ids), 1000):
+                yield ('[' if start == 0 else ',') + ','.join(items_json(snap, ids[start:start + 1000]))
+            yield ']' if len(ids) else '[]'
+        return app.response_class(generate(), mimetype='application/json')
+    body = f'{{"items":[{",".join(items_json(snap, ids))}],"next_cursor":{json.dumps(next_cursor)}}}'
+    return app.response_class(body, mimetype='application/json')
+
+@app.route('/api/scan_status')
+def scan_status():
+    """Reports background scan progress and indexed file counts."""
+    status = SCANNER.status()
+    type_counts = CATALOG.type_counts(configured_paths())
+    status['image_count'] = type_counts.get('image', 0)
+    status['video_count'] = type_counts.get('video', 0)
+    status['files_indexed'] = status['image_count'] + status['video_count']
+    return jsonify(status)
+
+@app.route('/api/thumbnails/progress')
+def thumbnail_progress():
+    """Reports the state of the background thumbnail pre-generation queue."""
+    progress = WARMER.progress()
+    progress['cache'] = THUMB_CACHE.stats()
+    return jsonify(progress)
 
 @app.route('/image/<encoded_path>')
 def serve_image(encoded_path):
+    """Serves an original file with Range support; ?v= (from the listing) makes it cacheable forever."""
     try:
         decoded_path = base64.urlsafe_b64decode(encoded_path).decode()
-        if os.path.exists(decoded_path):
-            return send_file(decoded_path)
-        else: return "File not found", 404
+        try:
+            st = os.stat(decoded_path)
+        except OSError:
+            return "File not found", 404
+        return send_media(decoded_path, st, version=request.args.get('v'))
     except Exception: return "Invalid path", 400
 
+def get_image_metadata(path):
+    """Returns an image's ImageMetadata from the index, reading the file only if it is stale or missing."""
+    st = os.stat(path)
+    meta = CATALOG.get_image_metadata(path, st.st_mtime, st.st_size)
+    CACHE_LOOKUPS.inc(cache='image_metadata', result='miss' if meta is None else 'hit')
+    if meta is None:
+        meta = CPU_POOL.run(read_image_metadata, path)
+        if meta is not None:
+            CATALOG.put_image_metadata(path, st.st_mtime, st.st_size, meta)
+            MEDIA_INDEX.refresh([path]) # The capture time may have changed its 'taken' position
+    return meta
+
 @app.route('/api/metadata/<encoded_path>')
 def get_metadata(encoded_path):
     """Returns basic metadata for a single image, including reverse-geocoded location."""
     img_data = {'width': 'N/A', 'height': 'N/A'}
     try:
         decoded_path = base64.urlsafe_b64decode(encoded_path).decode()
-        
-        VIDEO_EXTS = ('.mp4', '.webm', '.mov', '.avi', '.mkv')
-        if decoded_path.lower().endswith(VIDEO_EXTS):
-            cap = cv2.VideoCapture(decoded_path)
-            if cap.isOpened():
-                img_data['width'] = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-                img_data['height'] = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-                cap.release()
-        else: # It's an image
-            with Image.open(decoded_path) as img:
-                img_data['width'] = img.width
-                img_data['height'] = img.height
-                exif_data = img._getexif()
-                if exif_data:
-                    exif = { ExifTags.TAGS[k]: v for k, v in exif_data.items() if k in ExifTags.TAGS }
-                    img_data['model'] = exif.get('Model', 'N/A')
-                    
-                    gps_info = exif.get('GPSInfo')
-                    if gps_info:
-                        # (GPS processing logic remains the same)
-                        def to_degrees(c):
-                            def convert_val(val):
-                                if hasattr(val, 'numerator') and hasattr(val, 'denominator'):
-                                    return float(val.numerator) / float(val.denominator)
-                                return float(val)
-                            return convert_val(c[0]) + convert_val(c[1]) / 60 + convert_val(c[2]) / 3600
-                        
-                        lat_ref, lat_val = gps_info.get(1), gps_info.get(2, None)
-                        lon_ref, lon_val = gps_info.get(3), gps_info.get(4, None)
-
-                        if lat_val is None or lon_val is None:
-                            img_data['location'] = 'Incomplete GPS Data'
-                            return jsonify(img_data)
-
-                        lat = to_degrees(lat_val)
-                        if lat_ref == 'S': lat = -lat
-
-                        lon = to_degrees(lon_val)
-                        if lon_ref == 'W': lon = -lon
-
-                        cache_key = f"{lat:.5f},{lon:.5f}"
-                        if cache_key in GEO_CACHE:
-                            img_data['location'] = GEO_CACHE[cache_key]
+
+        if is_video(decoded_path):
+            # Served from the probe cache; the container is only opened the first time.
+            info = get_video_info(decoded_path, os.stat(decoded_path))
+            if info is not None:
+                img_data.update(info._asdict())
+        else: # It's an image; EXIF was parsed when it was indexed
+            meta = get_image_metadata(decoded_path)
+            if meta is not None and meta.width is not None:
+                img_data['width'] = meta.width
+                img_data['height'] = meta.height
+                img_data['taken'] = meta.taken
+                if meta.tags:
+                    img_data['model'] = meta.model or 'N/A'
+
+                    if meta.lat is not None:
+                        # Never waits on the geocoder; unknown places are queued and the
+                        # client asks again while location_status is 'pending'.
+                        status, address = GEOCODER.lookup(meta.lat, meta.lon)
+                        CACHE_LOOKUPS.inc(cache='geo', result={'resolved': 'hit', 'pending': 'miss'}.get(status, status))
+                        img_data['location_status'] = status
+                        if status == 'resolved':
+                            img_data['location'] = address
+                        elif status == 'pending':
+                            img_data['location'] = 'Resolving location...'
                         else:
-                            try:
-                                from geopy.geocoders import Nominatim
-                                geolocator = Nominatim(user_agent="photorium_app")
-                                location = geolocator.reverse((lat, lon), language='ko', timeout=5)
-                                address = location.address if location else 'Location not found'
-                                GEO_CACHE[cache_key] = address
-                                img_data['location'] = address
-                            except Exception:
-                                img_data['location'] = 'GPS data available' # Geocoding failed
+                            img_data['location'] = 'GPS data available' # Geocoding failed
+                    elif 'GPSInfo' in meta.tags:
+                        img_data['location'] = 'Incomplete GPS Data'
                     else:
                         img_data['location'] = 'No GPS Data'
+    except PoolBusy:
+        return busy_response()
+    except TaskTimeout:
+        return timeout_response()
     except Exception:
         # If even opening the image fails, we return the default N/A values
         pass
@@ -335,67 +587,248 @@ def get_exif(encoded_path):
     """Returns all available EXIF data for an image."""
     try:
         decoded_path = base64.urlsafe_b64decode(encoded_path).decode()
-        with Image.open(decoded_path) as img:
-            exif_data = img._getexif()
-            if not exif_data:
-                return jsonify({'message': 'No EXIF data found.'})
-
-            decoded_exif = {}
-            for k, v in exif_data.items():
-                tag_name = ExifTags.TAGS.get(k, k)
-                # Decode bytes to string if possible
-                if isinstance(v, bytes):
-                    try:
-                        v = v.decode(errors='ignore').strip('\x00')
-                    except:
-                        v = repr(v)
-                # Convert non-serializable types to string
-                if not isinstance(v, (str, int, float, bool, type(None))):
-                    v = str(v)
-                decoded_exif[str(tag_name)] = v
-            
-            return jsonify(decoded_exif)
+        meta = get_image_metadata(decoded_path)
+        if meta is None:
+            return jsonify({'error': 'Could not read EXIF data: unsupported or unreadable image'}), 500
+        if not meta.tags:
+            return jsonify({'message': 'No EXIF data found.'})
+        return jsonify(meta.tags)
+    except PoolBusy:
+        return busy_response()
+    except TaskTimeout:
+        return timeout_response()
     except Exception as e:
         return jsonify({'error': f'Could not read EXIF data: {str(e)}'}), 500
 
+@app.route('/api/geo/resolve', methods=['POST'])
+def resolve_folder_locations():
+    """Queues every GPS point in a collection for background reverse geocoding."""
+    data = request.get_json()
+    folder_path = data.get('path') if data else None
+    if folder_path not in configured_paths():
+        return jsonify({'error': 'Not a configured folder.'}), 400
+    queued = GEOCODER.enqueue(CATALOG.folder_coordinates(folder_path))
+    return jsonify({'success': True, 'queued': queued})
+
+@app.route('/api/geo/clusters')
+def geo_clusters():
+    """Returns photo counts per map grid cell for a bounding box and zoom level.
+
+    Query parameters:
+      bbox      south,west,north,east in degrees (default: the whole world)
+      zoom      web-map zoom level 0-22; cells shrink as it grows
+      folder    restrict to one configured collection
+    """
+    try:
+        south, west, north, east = (float(v) for v in request.args.get('bbox', '-90,-180,90,180').split(','))
+        zoom = request.args.get('zoom', 0, type=int)
+    except ValueError:
+        return jsonify({'error': 'bbox must be south,west,north,east.'}), 400
+    if not 0 <= zoom <= 22 or not -90 <= south <= north <= 90 or not (-180 <= west <= 180 and -180 <= east <= 180):
+        return jsonify({'error': 'Invalid bbox or zoom.'}), 400
+    folder_filter = request.args.get('folder')
+    folders = [f for f in configured_paths() if not folder_filter or f == folder_filter]
+
+    # About four cells across a 256px map tile, i.e. one cluster per ~64px.
+    cell_deg = 360 / (2 ** zoom * 4)
+    clusters = []
+    for count, lat, lon, sample in CATALOG.geo_clusters(folders, south, west, north, east, cell_deg):
+        clusters.append({'lat': lat, 'lon': lon, 'count': count,
+                         'sample': base64.urlsafe_b64encode(sample.encode()).decode()})
+    return jsonify({'zoom': zoom, 'cell_degrees': cell_deg, 'clusters': clusters,
+                    'total': sum(c['count'] for c in clusters)})
+
+@app.route('/api/geo/status')
+def geocoding_status():
+    """Reports the state of the background reverse-geocoding queue."""
+    return jsonify(GEOCODER.status())
+
+# --- Duplicates ---
+
+# Matching cost grows steeply with the distance (tens of seconds per 100k images at 12),
+# and beyond this dHash matches are mostly unrelated images anyway.
+MAX_DUPLICATE_DISTANCE = 8
+
+@app.route('/api/duplicates')
+def list_duplicates():
+    """Lists groups of duplicate and near-duplicate images (resized, re-encoded or lightly edited copies).
+
+    Query parameters:
+      max_distance  differing bits out of 64 allowed between perceptual hashes (0-8)
+      folder        restrict to one configured collection
+      limit, offset page through the groups, largest first
+
+    `pending` is true while the groups are being (re)computed in the
+    background; poll again to get the up-to-date result.
+    """
+    try:
+        max_distance = request.args.get('max_distance', CONFIG.get('duplicate_max_distance'), type=int)
+        limit = request.args.get('limit', 100, type=int)
+        offset = request.args.get('offset', 0, type=int)
+    except (ValueError, TypeError):
+        return jsonify({'error': 'Invalid query parameters.'}), 400
+    if not 0 <= max_distance <= MAX_DUPLICATE_DISTANCE or limit <= 0 or offset < 0:
+        return jsonify({'error': f'max_distance must be 0-{MAX_DUPLICATE_DISTANCE}; limit and offset must be positive.'}), 400
+    folder_filter = request.args.get('folder')
+    folders = [f for f in configured_paths() if not folder_filter or f == folder_filter]
+
+    # Matching runs on the hash indexer's thread; until it is done this
+    # serves the previous result, or none, with pending set.
+    groups, current = HASHER.groups(folders, max_distance)
+    groups = groups or []
+    result = []
+    for group in groups[offset:offset + limit]:
+        items = []
+        for path, filename, mtime, taken, size, dhash in group:
+            item = media_item(path, filename, mtime, 'image', taken, size)
+            item['size'] = size
+            item['dhash'] = f'{dhash & 0xFFFFFFFFFFFFFFFF:016x}'
+            items.append(item)
+        # Largest file first: usually the original the others were exported from.
+        items.sort(key=lambda item: item['size'], reverse=True)
+        result.append({'count': len(items), 'wasted_bytes': sum(item['size'] for item in items[1:]),
+                       'items': items})
+    images, hashed = CATALOG.hash_counts(folders)
+    return jsonify({'groups': result, 'total_groups': len(groups), 'max_distance': max_distance, 'pending': not current,
+                    'images': images, 'hashed': hashed, 'indexer': HASHER.status()})
+
 @app.route('/api/thumbnail/<encoded_path>')
 def serve_thumbnail(encoded_path):
-    """Generates and serves a small thumbnail for a given image path."""
+    """Serves a small thumbnail for a given media path, generating it on a cache miss."""
     try:
         decoded_path = base64.urlsafe_b64decode(encoded_path).decode()
-        if not os.path.exists(decoded_path):
+        try:
+            st = os.stat(decoded_path)
+        except OSError:
             return "File not found", 404
 
-        img = None
-        VIDEO_EXTS = ('.mp4', '.webm', '.mov', '.avi', '.mkv')
-
-        if decoded_path.lower().endswith(VIDEO_EXTS):
-            cap = cv2.VideoCapture(decoded_path)
-            if cap.isOpened():
-                ret, frame = cap.read()
-                if ret:
-                    frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                    img = Image.fromarray(frame_rgb)
-                cap.release()
-        else:
-            # For images, open and apply EXIF orientation correction
-            img_raw = Image.open(decoded_path)
-            img = ImageOps.exif_transpose(img_raw)
-
-        if img:
-            img.thumbnail((500, 500)) # Preserves aspect ratio
-            img_io = io.BytesIO()
-            
-            # Convert to RGB if it has transparency to save as JPEG
-            if img.mode in ('RGBA', 'P'):
-                img = img.convert('RGB')
-
-            img.save(img_io, 'JPEG', quality=80)
-            img_io.seek(0)
-            return send_file(img_io, mimetype='image/jpeg')
+        # One cached variant per size bucket and output format.
+        size = size_bucket(request.args.get('size', type=int) or CONFIG.get('gallery_grid_size'))
+        fmt = negotiate_format({mimetype for mimetype, _ in request.accept_mimetypes})
+
+        # The key changes whenever the source file does, so it is a valid strong ETag.
+        etag = THUMB_CACHE.make_key(decoded_path, st, f'{size}.{fmt}')
+        if request.if_none_match.contains_weak(etag):
+            CACHE_LOOKUPS.inc(cache='thumbnail', result='not_modified')
+            response = app.response_class(status=304)
+            response.set_etag(etag)
+            response.last_modified = st.st_mtime
+            response.vary.add('Accept')
+            set_cache_policy(response, st, request.args.get('v'))
+            return response
+
+        name = thumbnail_name(decoded_path, st, size, fmt)
+        cached_path = THUMB_CACHE.get(name)
+        response = None
+        if cached_path is not None:
+            try:
+                response = send_file(cached_path, mimetype=FORMATS[fmt][0], etag=etag, last_modified=st.st_mtime)
+            except OSError:
+                pass # Evicted by another thread since the lookup; render it again
+        CACHE_LOOKUPS.inc(cache='thumbnail', result='miss' if response is None else 'hit')
+        if response is None:
+            # Decoding is CPU bound, so it runs in the worker pool rather than on this thread.
+            if is_video(decoded_path):
+                data, probe, written = CPU_POOL.run(render_video_thumbnail, decoded_path,
+                                                    THUMB_CACHE.cache_dir, size, fmt)
+                store_video_results(decoded_path, probe, written)
+            else:
+                data = CPU_POOL.run(generate_thumbnail, decoded_path, size, fmt)
+            if data is None:
+                return "Could not generate thumbnail", 500
+            THUMB_CACHE.put(name, data)
+            # Served from memory: the cached copy may be evicted again at any time.
+            response = app.response_class(data, mimetype=FORMATS[fmt][0])
+            response.set_etag(etag)
+            response.last_modified = st.st_mtime
+        response.vary.add('Accept')
+        set_cache_policy(response, st, request.args.get('v'))
+        return response
+    except PoolBusy:
+        return busy_response()
+    except TaskTimeout:
+        return timeout_response()
     except Exception as e:
         return "Could not generate thumbnail", 500
 
+@app.route('/api/metrics')
+def metrics():
+    """Exposes request latencies, cache hit rates, stage timings and load in Prometheus text format."""
+    pool = CPU_POOL.stats()
+    cache = THUMB_CACHE.stats()
+    gauges = [
+        ('photorium_cpu_pool_in_flight', 'Tasks running or queued in the CPU worker pool.', pool['in_flight']),
+        ('photorium_cpu_pool_rejected', 'Requests turned away with 503 because the CPU pool was full.',
+         pool['rejected']),
+        ('photorium_thumbnail_cache_bytes', 'Size of the on-disk thumbnail cache.', cache['bytes']),
+        ('photorium_thumbnail_cache_entries', 'Entries in the on-disk thumbnail cache.', cache['entries']),
+        ('photorium_geocoder_queued', 'Coordinates waiting to be reverse-geocoded.', GEOCODER.status()['queued']),
+    ]
+    if WSGI_SERVER is not None:
+        gauges.append(('photorium_http_queue_depth', 'Requests waiting for a free server thread.',
+                       len(WSGI_SERVER.task_dispatcher.queue)))
+    return app.response_class(REGISTRY.render(gauges), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/api/server_status')
+def server_status():
+    """Reports request-thread and worker-pool load, so saturation shows up instead of being hidden."""
+    status = {'cpu_pool': CPU_POOL.stats(), 'geocoder': GEOCODER.status(), 'hash_indexer': HASHER.status()}
+    if WSGI_SERVER is not None:
+        dispatcher = WSGI_SERVER.task_dispatcher
+        status['http'] = {
+            'threads': len(dispatcher.threads),
+            'busy_threads': dispatcher.active_count,
+            'queue_depth': len(dispatcher.queue), # Requests waiting for a free thread
+        }
+    return jsonify(status)
+
+def warm_caches(folders=None):
+    """Scans the given (default: all) folders and renders every missing thumbnail."""
+    targets = [f for f in configured_paths() if not folders or f in folders]
+    for folder_path in targets:
+        print(f'Scanning {folder_path}...')
+        SCANNER.scan_folder(folder_path)
+        WARMER.enqueue(folder_path, [(row[0], row[2]) for row in CATALOG.query_media([folder_path])])
+    while True:
+        progress = WARMER.progress()
+        print(f"Thumbnails: {progress['done']} rendered, {progress['skipped']} already cached, "
+              f"{progress['failed']} failed, {progress['queued'] + progress['in_flight']} remaining")
+        if not progress['queued'] and not progress['in_flight']:
+            break
+        time.sleep(2)
+    WARMER.join()
+
+WSGI_SERVER = None
+
+def create_wsgi_server(host='127.0.0.1', port=5000):
+    """Creates the waitress server, keeping a handle so /api/server_status can read its queue."""
+    global WSGI_SERVER
+    from waitress.server import create_server
+    WSGI_SERVER = create_server(app, host=host, port=port, threads=load_config()['server_threads'])
+    WSGI_SERVER.print_listen('Serving on http://{}:{}')
+    return WSGI_SERVER
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='Photorium server')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.add_parser('serve', help='Run the web server (default)')
+    warm_parser = subparsers.add_parser('warm', help='Pre-generate thumbnails, e.g. from cron')
+    warm_parser.add_argument('--folder', action='append', help='Only warm this configured folder (repeatable)')
+    warm_parser.add_argument('--workers', type=int, help='Worker processes (default: one per core)')
+    args = parser.parse_args()
+
+    if args.command == 'warm':
+        if args.workers:
+            WARMER.max_workers = args.workers
+        warm_caches(args.folder)
+        return
+
+    start_background_services()
+    create_wsgi_server().run()
+
 if __name__ == '__main__':
-    from waitress import serve
-    serve(app, host='127.0.0.1', port=5000)
+    # Needed for the worker processes when running as a frozen (PyInstaller) executable.
+    import multiprocessing
+    multiprocessing.freeze_support()
+    main()
@@ -0,0 +1,187 @@
+"""Generates a synthetic media library for benchmarks: nested folders of JPEGs, PNGs and videos.
+
+Usage: python benchmarks/corpus.py OUT [--files 10000] [--fanout 8] [--depth 3] [--seed 1]
+
+JPEGs carry EXIF capture times, camera models and (for --gps-ratio of them)
+GPS coordinates; videos are short clips written with OpenCV. Encoding
+100k distinct images would take longer than the benchmark itself, so a
+handful of templates is rendered once and each file gets its own EXIF
+block spliced in, plus its own modification time. A corpus.json manifest
+records the parameters so an existing corpus can be reused.
+"""
+import os
+import io
+import sys
+import json
+import time
+import random
+import struct
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+MANIFEST = 'corpus.json'
+TEMPLATES = 12
+# Spread capture times over ten years ending at a fixed date, so runs are comparable.
+EPOCH_END = 1700000000
+TEN_YEARS = 10 * 365 * 24 * 3600
+
+
+def render_template(index, size):
+    """Draws one template picture: a gradient with shapes, so thumbnails have real work to do."""
+    from PIL import Image, ImageDraw
+    width, height = size
+    rng = random.Random(index)
+    img = Image.linear_gradient('L').resize(size).convert('RGB')
+    draw = ImageDraw.Draw(img)
+    for _ in range(30):
+        x, y = rng.randrange(width), rng.randrange(height)
+        r = rng.randrange(width // 20, width // 4)
+        draw.ellipse([x - r, y - r, x + r, y + r],
+                     fill=(rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+    return img
+
+
+def exif_block(rng, index):
+    """EXIF with a capture time and camera model; the caller may add GPS."""
+    from PIL import Image
+    exif = Image.Exif()
+    exif[0x0110] = f'Bench Camera {index % 5}'
+    taken = time.gmtime(EPOCH_END - rng.randrange(TEN_YEARS))
+    exif[0x8769] = {0x9003: time.strftime('%Y:%m:%d %H:%M:%S', taken)}
+    return exif
+
+
+def gps_ifd(lat, lon):
+    def dms(value):
+        value = abs(value)
+        degrees = int(value)
+        minutes = int((value - degrees) * 60)
+        seconds = round(((value - degrees) * 60 - minutes) * 60, 2)
+        return (degrees, minutes, seconds)
+    return {1: 'N' if lat >= 0 else 'S', 2: dms(lat), 3: 'E' if lon >= 0 else 'W', 4: dms(lon)}
+
+
+def splice_exif(jpeg, exif_bytes):
+    """Inserts an APP1 segment right after the JPEG's SOI marker."""
+    return jpeg[:2] + b'\xff\xe1' + struct.pack('>H', len(exif_bytes) + 2) + exif_bytes + jpeg[2:]
+
+
+def write_video(path, frames, size):
+    import cv2
+    import numpy as np
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), 24, size)
+    for i in range(frames):
+        frame = np.full((size[1], size[0], 3), (i * 7) % 256, dtype=np.uint8)
+        cv2.circle(frame, (i * 5 % size[0], size[1] // 2), size[1] // 6, (40, 200, 90), -1)
+        writer.write(frame)
+    writer.release()
+
+
+def folder_tree(root, fanout, depth):
+    """Returns every directory of a tree `depth` levels deep with `fanout` children each."""
+    dirs = [root]
+    level = [root]
+    for d in range(depth):
+        level = [os.path.join(parent, f'{"ymd"[d % 3]}{i:02d}') for parent in level for i in range(fanout)]
+        dirs.extend(level)
+    return dirs
+
+
+def generate_corpus(root, files=10000, fanout=8, depth=3, png_ratio=0.1, video_ratio=0.02,
+                    gps_ratio=0.3, image_size=(1600, 1200), video_frames=48, seed=1):
+    """Writes the corpus under root and returns its manifest; reuses an identical existing corpus."""
+    params = {'files': files, 'fanout': fanout, 'depth': depth, 'png_ratio': png_ratio,
+              'video_ratio': video_ratio, 'gps_ratio': gps_ratio, 'image_size': list(image_size),
+              'video_frames': video_frames, 'seed': seed}
+    manifest_path = os.path.join(root, MANIFEST)
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get('params') == params:
+            return manifest
+
+    started = time.perf_counter()
+    rng = random.Random(seed)
+    templates = [render_template(i, tuple(image_size)) for i in range(TEMPLATES)]
+    jpegs, pngs = [], []
+    for img in templates:
+        out = io.BytesIO()
+        img.save(out, 'JPEG', quality=88)
+        jpegs.append(out.getvalue())
+        out = io.BytesIO()
+        img.save(out, 'PNG', compress_level=1)
+        pngs.append(out.getvalue())
+    video_size = (image_size[0] // 4, image_size[1] // 4)
+    video_template = os.path.join(root, '.template.mp4')
+    os.makedirs(root, exist_ok=True)
+    write_video(video_template, video_frames, video_size)
+    with open(video_template, 'rb') as f:
+        video_bytes = f.read()
+    os.remove(video_template)
+
+    dirs = folder_tree(root, fanout, depth)
+    for path in dirs:
+        os.makedirs(path, exist_ok=True)
+    counts = {'image': 0, 'png': 0, 'video': 0, 'gps': 0}
+    for i in range(files):
+        directory = dirs[rng.randrange(len(dirs))]
+        kind = rng.random()
+        if kind < video_ratio:
+            path, data = os.path.join(directory, f'clip_{i:06d}.mp4'), video_bytes
+            counts['video'] += 1
+        elif kind < video_ratio + png_ratio:
+            path, data = os.path.join(directory, f'screen_{i:06d}.png'), pngs[i % TEMPLATES]
+            counts['png'] += 1
+        else:
+            exif = exif_block(rng, i)
+            if rng.random() < gps_ratio:
+                # Clustered around a few cities, like a real travel library.
+                lat, lon = rng.choice([(37.57, 126.98), (48.86, 2.35), (40.71, -74.01), (-33.87, 151.21)])
+                exif[0x8825] = gps_ifd(lat + rng.uniform(-0.05, 0.05), lon + rng.uniform(-0.05, 0.05))
+                counts['gps'] += 1
+            path = os.path.join(directory, f'IMG_{i:06d}.jpg')
+            data = splice_exif(jpegs[i % TEMPLATES], exif.tobytes())
+            counts['image'] += 1
+        with open(path, 'wb') as f:
+            f.write(data)
+        mtime = EPOCH_END - rng.randrange(TEN_YEARS)
+        os.utime(path, (mtime, mtime))
+
+    manifest = {'params': params, 'root': os.path.abspath(root), 'dirs': len(dirs), 'counts': counts,
+                'generated_in_s': time.perf_counter() - started}
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def add_corpus_arguments(parser):
+    """The corpus-shape options, shared with the benchmarks that generate a corpus."""
+    parser.add_argument('--files', type=int, default=10000)
+    parser.add_argument('--fanout', type=int, default=8, help='Subfolders per folder')
+    parser.add_argument('--depth', type=int, default=3, help='Folder nesting levels')
+    parser.add_argument('--png-ratio', type=float, default=0.1)
+    parser.add_argument('--video-ratio', type=float, default=0.02)
+    parser.add_argument('--gps-ratio', type=float, default=0.3, help='Share of JPEGs with GPS tags')
+    parser.add_argument('--image-size', type=int, nargs=2, default=[1600, 1200], metavar=('W', 'H'))
+    parser.add_argument('--seed', type=int, default=1)
+
+
+def corpus_from_args(root, args):
+    return generate_corpus(root, files=args.files, fanout=args.fanout, depth=args.depth,
+                           png_ratio=args.png_ratio, video_ratio=args.video_ratio, gps_ratio=args.gps_ratio,
+                           image_size=tuple(args.image_size), seed=args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('out', nargs='?', help='Target folder (default: a new temp folder)')
+    add_corpus_arguments(parser)
+    args = parser.parse_args()
+    root = args.out or tempfile.mkdtemp(prefix='photorium-corpus-')
+    print(json.dumps(corpus_from_args(root, args), indent=2))
+
+
+if __name__ == '__main__':
+    main()
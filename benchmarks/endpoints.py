@@ -0,0 +1,223 @@
+"""Measures the main Flask endpoints against a synthetic library: latency percentiles, throughput, RSS.
+
+Usage: python benchmarks/endpoints.py [--corpus DIR] [--files 10000] [--transport client|waitress]
+                                      [--clients 4] [--requests 200] [--output FILE]
+
+Generates (or reuses, see corpus.py) a corpus, points a fresh app
+instance at it from a temporary working directory, indexes it once, and
+then drives list_images, serve_thumbnail (cold and cached), get_metadata
+and browse_folders, either in-process through the Flask test client or
+over HTTP against a local waitress server. Results are printed as JSON
+(and written to --output) so runs before and after a change can be
+diffed.
+"""
+import os
+import sys
+import json
+import time
+import base64
+import random
+import socket
+import contextlib
+import argparse
+import tempfile
+import threading
+import http.client
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from corpus import add_corpus_arguments, corpus_from_args
+from thumbnail_decode import peak_rss_mb
+
+
+def children_peak_rss_mb():
+    """Peak RSS of the largest finished child process (e.g. CPU pool workers), where supported."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+
+def encode(path):
+    return base64.urlsafe_b64encode(path.encode()).decode()
+
+
+def start_app(workdir, corpus_root):
+    """Imports the app with its settings and caches inside workdir, and indexes the corpus."""
+    os.makedirs(os.path.join(workdir, 'settings'), exist_ok=True)
+    with open(os.path.join(workdir, 'settings', 'config.json'), 'w', encoding='utf-8') as f:
+        json.dump({'image_folders': [{'path': corpus_root, 'recursive': True, 'added_on': time.time()}],
+                   'pregenerate_thumbnails': False, # Thumbnail requests should measure cold renders
+                   'geocoder': 'stub'}, f) # Never hit the network
+    os.chdir(workdir) # The app keeps settings/ and cache/ relative to the working directory
+    started = time.perf_counter()
+    import app
+    import_s = time.perf_counter() - started
+    started = time.perf_counter()
+    app.SCANNER.scan_folder(corpus_root)
+    return app, {'import_s': import_s, 'index_s': time.perf_counter() - started}
+
+
+class TestClientTransport:
+    """Calls the app in-process; one Flask test client per thread."""
+
+    def __init__(self, flask_app):
+        self.app = flask_app
+        self._local = threading.local()
+
+    def request(self, method, url, body=None):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        response = client.open(url, method=method, json=body)
+        size = len(response.get_data())
+        response.close()
+        return response.status_code, size
+
+    def close(self):
+        pass
+
+
+class WaitressTransport:
+    """Serves the app with waitress in a background thread and calls it over HTTP."""
+
+    def __init__(self, app_module):
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            port = s.getsockname()[1]
+        with contextlib.redirect_stdout(sys.stderr): # Keep stdout pure JSON
+            self.server = app_module.create_wsgi_server('127.0.0.1', port)
+        self.port = port
+        threading.Thread(target=self.server.run, daemon=True).start()
+
+    def request(self, method, url, body=None):
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=120)
+        headers = {}
+        data = None
+        if body is not None:
+            data = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        conn.request(method, url, body=data, headers=headers)
+        response = conn.getresponse()
+        size = len(response.read())
+        conn.close()
+        return response.status, size
+
+    def close(self):
+        self.server.close()
+
+
+def run_workload(transport, name, calls, clients):
+    """Issues the (method, url, body) calls from `clients` threads and summarizes them."""
+    def timed(call):
+        start = time.perf_counter()
+        status, size = transport.request(*call)
+        return (time.perf_counter() - start) * 1000, status, size
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        results = list(pool.map(timed, calls))
+    wall = time.perf_counter() - started
+    timings = sorted(r[0] for r in results)
+    statuses = {}
+    for _, status, _ in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    return {
+        'endpoint': name,
+        'requests': len(results),
+        'statuses': statuses,
+        'p50_ms': timings[len(timings) // 2] if timings else None,
+        'p95_ms': timings[min(len(timings) - 1, int(len(timings) * 0.95))] if timings else None,
+        'mean_ms': sum(timings) / len(timings) if timings else None,
+        'throughput_rps': len(results) / wall if wall else None,
+        'mb_transferred': sum(r[2] for r in results) / (1024 * 1024),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def build_workloads(app_module, corpus_root, requests, page_size, seed):
+    """Returns [(name, calls)] for each benchmarked endpoint, sampled reproducibly from the catalog."""
+    rng = random.Random(seed)
+    rows = list(app_module.CATALOG.query_media([corpus_root]))
+    images = [row for row in rows if row[3] == 'image']
+    sample = [rng.choice(images) for _ in range(requests)] if images else []
+    thumb_size = app_module.CONFIG.get('gallery_grid_size')
+
+    # Page through the gallery the way gallery.js does, cursors included.
+    pages = []
+    for sort in ('mtime', 'taken'):
+        url = f'/api/images?limit={page_size}&sort={sort}'
+        for _ in range(max(1, requests // 4)):
+            pages.append(('GET', url, None))
+            data = json.loads(app_module.app.test_client().get(url).get_data())
+            if not data.get('next_cursor'):
+                break
+            url = f"/api/images?limit={page_size}&sort={sort}&cursor={data['next_cursor']}"
+
+    distinct = list(dict.fromkeys(row[0] for row in images))[:requests]
+    thumbs = [('GET', f'/api/thumbnail/{encode(path)}?size={thumb_size}', None) for path in distinct]
+    dirs = sorted({os.path.dirname(row[0]) for row in rows})
+    return [
+        ('list_images', pages),
+        ('serve_thumbnail_cold', thumbs),
+        ('serve_thumbnail_cached', thumbs),
+        ('get_metadata', [('GET', f'/api/metadata/{encode(row[0])}', None) for row in sample]),
+        ('browse_folders', [('POST', '/api/browse', {'path': rng.choice(dirs)}) for _ in range(requests)]),
+        ('serve_image', [('GET', f'/image/{encode(row[0])}', None) for row in sample]),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--corpus', help='Corpus folder, generated if missing (default: a temp folder)')
+    parser.add_argument('--transport', choices=['client', 'waitress'], default='client')
+    parser.add_argument('--clients', type=int, default=4, help='Concurrent requests')
+    parser.add_argument('--requests', type=int, default=200, help='Requests per endpoint')
+    parser.add_argument('--page-size', type=int, default=200)
+    parser.add_argument('--only', action='append', help='Only run this endpoint (repeatable)')
+    parser.add_argument('--output', help='Also write the JSON report to this file')
+    add_corpus_arguments(parser)
+    args = parser.parse_args()
+    output = os.path.abspath(args.output) if args.output else None
+
+    with tempfile.TemporaryDirectory() as tmp:
+        corpus_root = os.path.abspath(args.corpus or os.path.join(tmp, 'corpus'))
+        started = time.perf_counter()
+        manifest = corpus_from_args(corpus_root, args)
+        corpus_s = time.perf_counter() - started
+        app_module, setup = start_app(os.path.join(tmp, 'work'), corpus_root)
+        setup['corpus_s'] = corpus_s
+        transport = (WaitressTransport(app_module) if args.transport == 'waitress'
+                     else TestClientTransport(app_module.app))
+        results = []
+        try:
+            for name, calls in build_workloads(app_module, corpus_root, args.requests, args.page_size, args.seed):
+                if args.only and name not in args.only:
+                    continue
+                results.append(run_workload(transport, name, calls, args.clients))
+        finally:
+            transport.close()
+            app_module.CPU_POOL.shutdown()
+            os.chdir(os.path.dirname(tmp)) # Let the temp folder be removed
+
+    report = {
+        'transport': args.transport,
+        'clients': args.clients,
+        'corpus': {'root': corpus_root, 'dirs': manifest['dirs'], **manifest['counts']},
+        'setup': setup,
+        'results': results,
+        'peak_rss_mb': peak_rss_mb(),
+        'workers_peak_rss_mb': children_peak_rss_mb(),
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            f.write(text)
+
+
+if __name__ == '__main__':
+    main()
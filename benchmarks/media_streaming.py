@@ -0,0 +1,130 @@
+"""Measures concurrent video streaming throughput: plain send_file vs. the Range-aware media path.
+
+Usage: python benchmarks/media_streaming.py [--size-mb 128] [--clients 8] [--requests 40] [FILE]
+
+Serves FILE (or a generated dummy .mp4 of --size-mb) under waitress from a
+background thread, the way the app is deployed, and points --clients
+concurrent HTTP clients at it. Two workloads are run per mode: 'scrub'
+issues random 1 MB Range requests like a player seeking through a video,
+'full' downloads the whole file. Results are printed as JSON.
+"""
+import os
+import sys
+import json
+import time
+import random
+import socket
+import argparse
+import tempfile
+import threading
+import http.client
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+RANGE_BYTES = 1024 * 1024
+
+
+def make_app(path):
+    from flask import Flask, send_file
+    from serving import send_media
+    bench_app = Flask(__name__)
+
+    @bench_app.route('/send_file')
+    def plain():
+        # What /image used to do.
+        return send_file(path)
+
+    @bench_app.route('/send_media')
+    def media():
+        return send_media(path, os.stat(path))
+
+    return bench_app
+
+
+def start_server(bench_app, threads):
+    from waitress.server import create_server
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    server = create_server(bench_app, host='127.0.0.1', port=port, threads=threads)
+    threading.Thread(target=server.run, daemon=True).start()
+    return server, port
+
+
+def fetch(port, route, byte_range=None):
+    """Performs one GET and returns (latency_ms, status, bytes received)."""
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    headers = {'Range': f'bytes={byte_range[0]}-{byte_range[1]}'} if byte_range else {}
+    start = time.perf_counter()
+    conn.request('GET', f'/{route}', headers=headers)
+    response = conn.getresponse()
+    received = 0
+    while True:
+        chunk = response.read(1024 * 1024)
+        if not chunk:
+            break
+        received += len(chunk)
+    elapsed = (time.perf_counter() - start) * 1000
+    conn.close()
+    return elapsed, response.status, received
+
+
+def run_workload(port, route, workload, file_size, clients, requests):
+    rng = random.Random(42)
+    ranges = []
+    for _ in range(requests):
+        if workload == 'scrub':
+            offset = rng.randrange(0, max(1, file_size - RANGE_BYTES))
+            ranges.append((offset, offset + RANGE_BYTES - 1))
+        else:
+            ranges.append(None)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        results = list(pool.map(lambda r: fetch(port, route, r), ranges))
+    wall = time.perf_counter() - started
+    timings = sorted(r[0] for r in results)
+    total_bytes = sum(r[2] for r in results)
+    return {
+        'route': route,
+        'workload': workload,
+        'requests': len(results),
+        'statuses': sorted({r[1] for r in results}),
+        'mb_transferred': total_bytes / (1024 * 1024),
+        'throughput_mb_s': total_bytes / (1024 * 1024) / wall,
+        'p50_ms': timings[len(timings) // 2],
+        'p95_ms': timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('file', nargs='?')
+    parser.add_argument('--size-mb', type=int, default=128)
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=40)
+    parser.add_argument('--full-requests', type=int, default=8, help='Whole-file downloads per mode')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.file
+        if not path:
+            path = os.path.join(tmp, 'dummy.mp4')
+            with open(path, 'wb') as f:
+                for _ in range(args.size_mb):
+                    f.write(os.urandom(1024 * 1024))
+        file_size = os.path.getsize(path)
+        server, port = start_server(make_app(os.path.abspath(path)), threads=args.clients)
+        results = []
+        try:
+            for route in ('send_file', 'send_media'):
+                fetch(port, route, (0, 0)) # Warm up
+                results.append(run_workload(port, route, 'scrub', file_size, args.clients, args.requests))
+                results.append(run_workload(port, route, 'full', file_size, args.clients, args.full_requests))
+        finally:
+            server.close()
+    print(json.dumps({'file_mb': file_size / (1024 * 1024), 'clients': args.clients, 'results': results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+"""Measures server cold start: import time breakdown and time until the first responses.
+
+Usage: python benchmarks/startup.py [--runs 5] [--folder DIR] [--top 15] [--output FILE]
+
+Each run starts a fresh interpreter with `python -X importtime` that
+imports app, starts the background services and serves on a free port,
+from a temporary working directory (so settings/ and cache/ start empty,
+plus --folder as a collection if given). The parent process times how
+long it takes from spawning it until / and the first gallery page
+respond. Reported times are medians over the runs; the breakdown lists
+the slowest top-level imports and their direct imports (app's own
+modules), the cumulative import time of the known heavy modules, and
+`lazy` records which of those were not loaded at startup at all.
+Results are printed as JSON (and written to --output) so runs before
+and after a change can be diffed.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import tempfile
+import statistics
+import subprocess
+import http.client
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Modules that are slow to import and only needed by some requests.
+HEAVY = ('cv2', 'PIL.Image', 'PIL.TiffImagePlugin', 'numpy', 'geopy', 'flask', 'waitress')
+# Runs in the child interpreter; the STARTUP line is picked out of its stdout.
+CHILD = '''
+import sys, time, json
+started = time.perf_counter()
+sys.path.insert(0, {root!r})
+import app
+imported = time.perf_counter()
+app.start_background_services()
+server = app.create_wsgi_server('127.0.0.1', {port})
+print('STARTUP ' + json.dumps({{'import_s': imported - started, 'serving_s': time.perf_counter() - started,
+                               'lazy': {{m: m not in sys.modules for m in {heavy!r}}}}}), flush=True)
+server.run()
+'''
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def parse_importtime(stderr):
+    """Parses -X importtime output into [(module, depth, self_ms, cumulative_ms)]."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        _, self_us, cumulative_us, name = (part for part in line.replace('import time:', '|', 1).split('|'))
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        rows.append((name.strip(), depth, int(self_us) / 1000, int(cumulative_us) / 1000))
+    return rows
+
+
+def wait_for(port, path, deadline):
+    """Polls until GET path answers 200; returns the time it did, or None on timeout."""
+    while time.perf_counter() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            conn.request('GET', path)
+            response = conn.getresponse()
+            response.read()
+            conn.close()
+            if response.status == 200:
+                return time.perf_counter()
+        except OSError:
+            pass
+        time.sleep(0.005)
+    return None
+
+
+def run_once(workdir, timeout):
+    port = free_port()
+    script = CHILD.format(root=ROOT, port=port, heavy=HEAVY)
+    # Output goes to files: -X importtime writes enough to fill a pipe before anyone reads it.
+    with tempfile.TemporaryFile('w+') as out, tempfile.TemporaryFile('w+') as err:
+        started = time.perf_counter()
+        process = subprocess.Popen([sys.executable, '-X', 'importtime', '-c', script], cwd=workdir,
+                                   stdout=out, stderr=err, text=True)
+        try:
+            deadline = started + timeout
+            first_response = wait_for(port, '/', deadline)
+            first_page = wait_for(port, '/api/images?limit=100', deadline) if first_response else None
+        finally:
+            process.terminate()
+            process.wait()
+        out.seek(0)
+        err.seek(0)
+        stdout, stderr = out.read(), err.read()
+    if first_response is None:
+        raise RuntimeError(f'Server did not respond within {timeout} s:\n{stderr[-2000:]}')
+    child = next(json.loads(line[len('STARTUP '):]) for line in stdout.splitlines() if line.startswith('STARTUP '))
+    return {
+        'first_response_s': first_response - started,
+        'first_page_s': first_page - started if first_page else None,
+        'import_s': child['import_s'],
+        'serving_s': child['serving_s'],
+        'lazy': child['lazy'],
+        'imports': parse_importtime(stderr),
+    }
+
+
+def summarize(runs, top):
+    def median(key):
+        values = [run[key] for run in runs if run[key] is not None]
+        return statistics.median(values) if values else None
+
+    top_level = {}
+    heavy = {}
+    for run in runs:
+        seen = set()
+        for name, depth, _, cumulative in run['imports']:
+            if depth <= 1: # Top-level imports and what they import directly (app's own imports)
+                top_level.setdefault(name, []).append(cumulative)
+            if name in HEAVY and name not in seen: # Its first import is the one that paid for it
+                seen.add(name)
+                heavy.setdefault(name, []).append(cumulative)
+    slowest = sorted(((name, statistics.median(values)) for name, values in top_level.items()),
+                     key=lambda item: item[1], reverse=True)[:top]
+    return {
+        'runs': len(runs),
+        'first_response_s': median('first_response_s'),
+        'first_page_s': median('first_page_s'),
+        'app_import_s': median('import_s'),
+        'serving_s': median('serving_s'),
+        'lazy': runs[-1]['lazy'],
+        'top_imports_ms': [{'module': name, 'cumulative_ms': round(ms, 1)} for name, ms in slowest],
+        'heavy_imports_ms': {name: round(statistics.median(values), 1) for name, values in heavy.items()},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--folder', help='Library folder to configure (default: none)')
+    parser.add_argument('--top', type=int, default=15, help='Slowest top-level imports to list')
+    parser.add_argument('--timeout', type=float, default=120.0, help='Seconds to wait for each server')
+    parser.add_argument('--output', help='Also write the JSON report to this file')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        os.makedirs(os.path.join(workdir, 'settings'))
+        folders = [{'path': os.path.abspath(args.folder), 'recursive': True, 'added_on': time.time()}] \
+            if args.folder else []
+        with open(os.path.join(workdir, 'settings', 'config.json'), 'w', encoding='utf-8') as f:
+            json.dump({'image_folders': folders, 'pregenerate_thumbnails': False, 'geocoder': 'stub'}, f)
+        runs = [run_once(workdir, args.timeout) for _ in range(args.runs)]
+
+    text = json.dumps(summarize(runs, args.top), indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+
+
+if __name__ == '__main__':
+    main()
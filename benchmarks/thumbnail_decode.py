@@ -0,0 +1,118 @@
+"""Compares thumbnail decode latency and peak memory: full decode vs. the fast JPEG path.
+
+Usage: python benchmarks/thumbnail_decode.py [--megapixels 24] [--runs 10] [FILE ...]
+
+Without FILE arguments a synthetic camera-sized JPEG is generated in a temp
+directory. Each mode runs in its own subprocess so peak RSS is not shared
+between them. Results are printed as JSON.
+"""
+import os
+import sys
+import io
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB, or None where unsupported."""
+    try:
+        import resource
+    except ImportError: # Windows
+        try:
+            import psutil
+            return psutil.Process().memory_info().peak_wset / (1024 * 1024)
+        except (ImportError, AttributeError):
+            return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in KB on Linux and bytes on macOS.
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+
+def decode_full(path, size):
+    """The original path: full-resolution decode, transpose, then downscale."""
+    from PIL import Image, ImageOps
+    img = ImageOps.exif_transpose(Image.open(path))
+    img.thumbnail(size)
+    out = io.BytesIO()
+    img.convert('RGB').save(out, 'JPEG', quality=80)
+    return out.getvalue()
+
+
+def decode_fast(path, size):
+    from thumbnails import generate_thumbnail
+    return generate_thumbnail(path, size[0])
+
+
+def run_mode(mode, files, size, runs):
+    """Runs one mode in-process and returns its timings (used by the subprocess)."""
+    import thumbnails # Imported up front in both modes so import cost and memory are equal
+    func = decode_full if mode == 'full' else decode_fast
+    timings = []
+    for _ in range(runs):
+        for path in files:
+            start = time.perf_counter()
+            func(path, size)
+            timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return {
+        'mode': mode,
+        'decodes': len(timings),
+        'mean_ms': sum(timings) / len(timings),
+        'p50_ms': timings[len(timings) // 2],
+        'p95_ms': timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def make_sample(directory, megapixels):
+    """Writes a camera-sized JPEG with an EXIF orientation tag."""
+    from PIL import Image, ImageDraw
+    width = int((megapixels * 1_000_000 * 3 / 2) ** 0.5)
+    height = width * 2 // 3
+    img = Image.new('RGB', (width, height), 'white')
+    draw = ImageDraw.Draw(img)
+    for i in range(0, width, max(1, width // 40)):
+        draw.line([(i, 0), (width - i, height)], fill=(i % 255, 80, 160), width=9)
+    exif = Image.Exif()
+    exif[0x0112] = 6 # Rotated, so the transpose path is exercised too
+    path = os.path.join(directory, f'sample_{megapixels}mp.jpg')
+    img.save(path, 'JPEG', quality=92, exif=exif.tobytes())
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('files', nargs='*')
+    parser.add_argument('--megapixels', type=int, default=24)
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--size', type=int, default=500)
+    parser.add_argument('--mode', choices=['full', 'fast'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    size = (args.size, args.size)
+
+    if args.mode: # Child process
+        print(json.dumps(run_mode(args.mode, args.files, size, args.runs)))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        files = args.files or [make_sample(tmp, args.megapixels)]
+        results = []
+        for mode in ('full', 'fast'):
+            out = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--mode', mode, '--runs', str(args.runs),
+                 '--size', str(args.size), *files],
+                check=True, capture_output=True, text=True)
+            results.append(json.loads(out.stdout))
+    full, fast = results
+    report = {'files': len(files), 'target_size': args.size, 'results': results,
+              'speedup': full['mean_ms'] / fast['mean_ms'] if fast['mean_ms'] else None}
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from walker import media_type, is_hidden
+
+UNREADABLE = {'image': -1, 'video': -1} # Shown for folders that can't be listed
+
+
+def list_directory(dir_path, show_hidden=False):
+    """Lists a directory in one os.scandir pass.
+
+    Returns (subdirectory names, media file names). DirEntry.is_dir() comes
+    from the directory listing itself on Windows and on most Linux
+    filesystems, so this costs one round-trip instead of one per entry.
+    """
+    dirs = []
+    files = []
+    with os.scandir(dir_path) as it:
+        for entry in it:
+            if not show_hidden and is_hidden(entry.name):
+                continue
+            try:
+                if entry.is_dir():
+                    dirs.append(entry.name)
+                    continue
+            except OSError:
+                continue
+            if media_type(entry.name) is not None:
+                files.append(entry.name)
+    return dirs, files
+
+
+def count_media(dir_path):
+    """Counts the images and videos directly inside a directory, by extension."""
+    counts = {'image': 0, 'video': 0}
+    with os.scandir(dir_path) as it:
+        for entry in it:
+            if is_hidden(entry.name):
+                continue # The catalog never indexes these either
+            kind = media_type(entry.name)
+            if kind is not None:
+                counts[kind] += 1
+    return counts
+
+
+class DirCountCache:
+    """Per-directory media counts, reused while the directory's mtime is unchanged.
+
+    Counts only depend on which names a directory holds, and adding,
+    removing or renaming an entry updates the directory mtime, so an
+    unchanged mtime means the counts are still right. Within `ttl` seconds
+    of the last check an entry is trusted without even that stat, which
+    matters on network shares.
+    """
+
+    def __init__(self, ttl=30.0, max_entries=50000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict() # path -> (mtime_ns, checked_at, counts)
+
+    def get(self, dir_path):
+        with self._lock:
+            entry = self._entries.get(dir_path)
+        if entry is None:
+            return None
+        mtime_ns, checked_at, counts = entry
+        now = time.monotonic()
+        if now - checked_at < self.ttl:
+            return counts
+        try:
+            if os.stat(dir_path).st_mtime_ns != mtime_ns:
+                return None
+        except OSError:
+            return None
+        with self._lock:
+            if dir_path in self._entries:
+                self._entries[dir_path] = (mtime_ns, now, counts)
+                self._entries.move_to_end(dir_path)
+        return counts
+
+    def put(self, dir_path, mtime_ns, counts):
+        with self._lock:
+            self._entries[dir_path] = (mtime_ns, time.monotonic(), counts)
+            self._entries.move_to_end(dir_path)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class FolderCounter:
+    """Counts media in many directories concurrently, within a time budget.
+
+    counts() returns whatever is known when the budget runs out; the
+    remaining directories keep being counted in the background and land in
+    the cache, so a follow-up request picks them up. A directory is never
+    counted twice at once.
+    """
+
+    def __init__(self, cache=None, max_workers=16):
+        self.cache = cache or DirCountCache()
+        self.max_workers = max_workers
+        self._lock = threading.Lock()
+        self._pool = None
+        self._in_flight = {} # dir_path -> Future
+
+    def _executor(self):
+        with self._lock:
+            if self._pool is None:
+                # Directory reads are I/O bound (often network latency), so threads suffice.
+                self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='dircount')
+            return self._pool
+
+    def _count(self, dir_path):
+        try:
+            # Stat first: if the directory changes while it is read, the entry is just revalidated later.
+            mtime_ns = os.stat(dir_path).st_mtime_ns
+            counts = count_media(dir_path)
+        except OSError:
+            counts = UNREADABLE
+        else:
+            self.cache.put(dir_path, mtime_ns, counts)
+        finally:
+            with self._lock:
+                self._in_flight.pop(dir_path, None)
+        return counts
+
+    def counts(self, dir_paths, budget):
+        """Returns {dir_path: counts, or None if still being counted after `budget` seconds}."""
+        results = {}
+        futures = {}
+        for dir_path in dir_paths:
+            counts = self.cache.get(dir_path)
+            if counts is not None:
+                results[dir_path] = counts
+                continue
+            executor = self._executor()
+            with self._lock:
+                future = self._in_flight.get(dir_path)
+                if future is None:
+                    future = self._in_flight[dir_path] = executor.submit(self._count, dir_path)
+            futures[future] = dir_path
+        if futures:
+            wait(futures, timeout=budget)
+        for future, dir_path in futures.items():
+            if not future.done():
+                results[dir_path] = None
+            else:
+                results[dir_path] = UNREADABLE if future.exception() is not None else future.result()
+        return results
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
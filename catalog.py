@@ -0,0 +1,475 @@
+import os
+import json
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from walker import walk_media
+from video import VideoInfo
+from metadata import ImageMetadata, read_image_metadata, encode_tags
+
+CATALOG_FILE = os.path.join('cache', 'catalog.db')
+
+# Each entry upgrades the schema by one version (tracked in PRAGMA user_version).
+MIGRATIONS = [
+    """
+    CREATE TABLE media (
+        path TEXT PRIMARY KEY,
+        folder TEXT NOT NULL,
+        dir TEXT NOT NULL,
+        filename TEXT NOT NULL,
+        mtime REAL NOT NULL,
+        size INTEGER NOT NULL,
+        type TEXT NOT NULL
+    );
+    CREATE INDEX idx_media_mtime ON media (mtime DESC, path DESC);
+    CREATE INDEX idx_media_folder ON media (folder, mtime DESC);
+    CREATE INDEX idx_media_type ON media (type, mtime DESC);
+    CREATE TABLE folders (
+        path TEXT PRIMARY KEY,
+        dir_mtime REAL,
+        scanned_on REAL
+    );
+    """,
+    """
+    CREATE INDEX idx_media_dir ON media (dir);
+    """,
+    """
+    CREATE TABLE dirs (
+        path TEXT NOT NULL,
+        folder TEXT NOT NULL,
+        parent TEXT,
+        dir_mtime REAL,
+        PRIMARY KEY (folder, path)
+    );
+    CREATE INDEX idx_dirs_path ON dirs (path);
+    INSERT INTO dirs SELECT path, path, NULL, dir_mtime FROM folders;
+    """,
+    """
+    CREATE TABLE video_info (
+        path TEXT PRIMARY KEY,
+        mtime REAL NOT NULL,
+        size INTEGER NOT NULL,
+        width INTEGER,
+        height INTEGER,
+        duration REAL,
+        fps REAL,
+        codec TEXT
+    );
+    """,
+    """
+    ALTER TABLE media ADD COLUMN taken REAL;
+    UPDATE media SET taken = mtime;
+    CREATE INDEX idx_media_taken ON media (taken DESC, path DESC);
+    CREATE TABLE image_meta (
+        path TEXT PRIMARY KEY,
+        mtime REAL NOT NULL,
+        size INTEGER NOT NULL,
+        width INTEGER,
+        height INTEGER,
+        model TEXT,
+        taken REAL,
+        lat REAL,
+        lon REAL,
+        tags TEXT
+    );
+    """,
+    """
+    CREATE TABLE places (
+        key TEXT PRIMARY KEY,
+        lat REAL NOT NULL,
+        lon REAL NOT NULL,
+        address TEXT NOT NULL,
+        resolved_on REAL
+    );
+    """,
+    """
+    CREATE INDEX idx_image_meta_location ON image_meta (lat, lon) WHERE lat IS NOT NULL;
+    """,
+    """
+    CREATE TABLE image_hash (
+        path TEXT PRIMARY KEY,
+        mtime REAL NOT NULL,
+        size INTEGER NOT NULL,
+        dhash INTEGER
+    );
+    """,
+]
+
+# Columns list_images can order by: file modification time, or EXIF capture
+# time (media.taken falls back to the mtime for files without one).
+SORT_KEYS = ('mtime', 'taken')
+
+
+ScanResult = namedtuple('ScanResult', ['added', 'modified', 'removed'])
+
+
+class Catalog:
+    """A persistent SQLite index of every media file in the configured folders."""
+
+    def __init__(self, db_path=CATALOG_FILE, scan_workers=8):
+        self.db_path = db_path
+        self._local = threading.local()
+        # Shared by all folder walks; directory reads are I/O bound, so threads suffice.
+        self._walk_pool = ThreadPoolExecutor(max_workers=scan_workers, thread_name_prefix='walker')
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self._migrate()
+
+    def _conn(self):
+        """Returns this thread's connection; sqlite3 connections can't be shared across threads."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _migrate(self):
+        conn = self._conn()
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        for i, script in enumerate(MIGRATIONS[version:], start=version + 1):
+            with conn:
+                conn.executescript(script)
+                conn.execute(f'PRAGMA user_version = {i}')
+
+    # --- Scanning ---
+
+    def sync_folder(self, folder_path, force=True, recursive=False, max_depth=None,
+                    exclude=(), skip_dirs=()):
+        """Brings the catalog rows for one folder in line with what is on disk.
+
+        With recursive=True the whole tree is indexed, down to `max_depth`
+        levels (None = unlimited); `exclude` holds glob patterns matched
+        against names and relative paths, and `skip_dirs` subtrees are left
+        to their own collections. Adding, removing or renaming files bumps a
+        directory's mtime, so with force=False unchanged directories cost a
+        single stat and are not re-read; in-place edits only show up on a
+        forced sync. Returns a ScanResult listing the changed paths, or None
+        if the folder is not a readable directory.
+        """
+        conn = self._conn()
+        known_dirs = {}
+        for path, parent, dir_mtime in conn.execute(
+                'SELECT path, parent, dir_mtime FROM dirs WHERE folder = ?', (folder_path,)):
+            known_dirs.setdefault(path, [None, []])[0] = dir_mtime
+            if parent is not None:
+                known_dirs.setdefault(parent, [None, []])[1].append(path)
+
+        walk = walk_media(folder_path, self._walk_pool, max_depth=max_depth if recursive else 0,
+                          exclude=exclude, skip_dirs=skip_dirs, known=known_dirs, force=force)
+        if walk is None:
+            return None
+
+        result = ScanResult([], [], [])
+        rows = []
+        vanished = [path for path in known_dirs if path not in walk.dirs]
+        stale_dirs = set(walk.listed).union(vanished)
+        if stale_dirs:
+            known = {}
+            for path, dir_path, mtime, size in conn.execute(
+                    'SELECT path, dir, mtime, size FROM media WHERE folder = ?', (folder_path,)):
+                if dir_path in stale_dirs:
+                    known[path] = (mtime, size)
+            found = set()
+            for dir_path, files in walk.listed.items():
+                for f in files:
+                    found.add(f.path)
+                    previous = known.get(f.path)
+                    if previous == (f.mtime, f.size):
+                        continue
+                    (result.added if previous is None else result.modified).append(f.path)
+                    rows.append([f.path, folder_path, dir_path, f.name, f.mtime, f.size, f.type, f.mtime])
+            result.removed.extend(path for path in known if path not in found)
+
+        # EXIF is parsed once here, when a file is indexed, so metadata requests
+        # are plain lookups. A forced sync also backfills files indexed before
+        # the metadata table existed.
+        to_read = [row for row in rows if row[6] == 'image']
+        if force:
+            changed = {row[0] for row in rows}
+            to_read.extend(list(row) for row in conn.execute(
+                'SELECT m.* FROM media m LEFT JOIN image_meta i ON i.path = m.path '
+                "WHERE m.folder = ? AND m.type = 'image' AND i.path IS NULL", (folder_path,))
+                if row[0] not in changed)
+        meta_rows = []
+        for row, meta in zip(to_read, self._walk_pool.map(read_image_metadata, [row[0] for row in to_read])):
+            meta = meta or ImageMetadata(None, None, None, None, None, None, {})
+            meta_rows.append(self._meta_row(row[0], row[4], row[5], meta))
+            row[7] = meta.taken or row[4] # Sort key: capture time, else mtime
+        rows = [row for row in rows if row[6] != 'image'] + to_read
+
+        with conn:
+            conn.executemany('INSERT OR REPLACE INTO media VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+            conn.executemany('INSERT OR REPLACE INTO image_meta VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', meta_rows)
+            conn.executemany('DELETE FROM media WHERE path = ?', [(path,) for path in result.removed])
+            conn.executemany('DELETE FROM video_info WHERE path = ?', [(path,) for path in result.removed])
+            conn.executemany('DELETE FROM image_meta WHERE path = ?', [(path,) for path in result.removed])
+            conn.executemany('DELETE FROM image_hash WHERE path = ?', [(path,) for path in result.removed])
+            conn.executemany('DELETE FROM dirs WHERE folder = ? AND path = ?',
+                             [(folder_path, path) for path in vanished])
+            conn.executemany('INSERT OR REPLACE INTO dirs VALUES (?, ?, ?, ?)',
+                             [(path, folder_path, parent, dir_mtime)
+                              for path, (parent, dir_mtime) in walk.dirs.items()])
+            conn.execute('INSERT OR REPLACE INTO folders VALUES (?, ?, ?)',
+                         (folder_path, walk.dirs[folder_path][1], time.time()))
+        return result
+
+    def remove_folder(self, folder_path):
+        """Drops all catalog rows belonging to a folder."""
+        conn = self._conn()
+        with conn:
+            conn.execute('DELETE FROM video_info WHERE path IN (SELECT path FROM media WHERE folder = ?)',
+                         (folder_path,))
+            conn.execute('DELETE FROM image_meta WHERE path IN (SELECT path FROM media WHERE folder = ?)',
+                         (folder_path,))
+            conn.execute('DELETE FROM image_hash WHERE path IN (SELECT path FROM media WHERE folder = ?)',
+                         (folder_path,))
+            conn.execute('DELETE FROM media WHERE folder = ?', (folder_path,))
+            conn.execute('DELETE FROM dirs WHERE folder = ?', (folder_path,))
+            conn.execute('DELETE FROM folders WHERE path = ?', (folder_path,))
+
+    # --- Queries ---
+
+    def query_media(self, folders, media_type=None, since=None, until=None,
+                    after=None, descending=True, limit=None, sort='mtime'):
+        """Yields (path, filename, mtime, type, taken, size) rows ordered by (sort key, path).
+
+        `sort` is one of SORT_KEYS; `since`/`until` bound that same key.
+        `after` is the (key, path) of the last row already seen, which lets
+        callers page through the results with a stable keyset cursor. Rows
+        are fetched in chunks so large listings can be streamed.
+        """
+        if not folders:
+            return
+        if sort not in SORT_KEYS:
+            raise ValueError(f'Unknown sort key: {sort}')
+        clauses = [f"folder IN ({','.join('?' * len(folders))})"]
+        params = list(folders)
+        if media_type:
+            clauses.append('type = ?')
+            params.append(media_type)
+        if since is not None:
+            clauses.append(f'{sort} >= ?')
+            params.append(since)
+        if until is not None:
+            clauses.append(f'{sort} <= ?')
+            params.append(until)
+        if after is not None:
+            op = '<' if descending else '>'
+            clauses.append(f'({sort} {op} ? OR ({sort} = ? AND path {op} ?))')
+            params.extend([after[0], after[0], after[1]])
+        direction = 'DESC' if descending else 'ASC'
+        sql = (f"SELECT path, filename, mtime, type, taken, size FROM media WHERE {' AND '.join(clauses)} "
+               f'ORDER BY {sort} {direction}, path {direction}')
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params.append(limit)
+        cursor = self._conn().execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(1000)
+            if not rows:
+                break
+            yield from rows
+
+    def folder_counts(self):
+        """Returns a {folder: media_count} mapping for every cataloged folder."""
+        return dict(self._conn().execute('SELECT folder, COUNT(*) FROM media GROUP BY folder'))
+
+    def media_rows(self, paths=None):
+        """Yields (path, folder, mtime, type, taken, size) for the given paths, or for every file."""
+        conn = self._conn()
+        sql = 'SELECT path, folder, mtime, type, taken, size FROM media'
+        if paths is None:
+            cursor = conn.execute(sql)
+            while True:
+                rows = cursor.fetchmany(5000)
+                if not rows:
+                    break
+                yield from rows
+            return
+        paths = list(paths)
+        for i in range(0, len(paths), 500):
+            chunk = paths[i:i + 500]
+            yield from conn.execute(f"{sql} WHERE path IN ({','.join('?' * len(chunk))})", chunk)
+
+    def get_mtimes(self, paths):
+        """Returns (path, mtime) pairs for the given cataloged paths."""
+        conn = self._conn()
+        paths = list(paths)
+        rows = []
+        for i in range(0, len(paths), 500):
+            chunk = paths[i:i + 500]
+            rows.extend(conn.execute(
+                f"SELECT path, mtime FROM media WHERE path IN ({','.join('?' * len(chunk))})", chunk))
+        return rows
+
+    def type_counts(self, folders):
+        """Returns a {type: count} mapping across the given folders."""
+        if not folders:
+            return {}
+        placeholders = ','.join('?' * len(folders))
+        return dict(self._conn().execute(
+            f'SELECT type, COUNT(*) FROM media WHERE folder IN ({placeholders}) GROUP BY type', list(folders)))
+
+    def dir_counts(self, dirs):
+        """Returns {dir: {'image': n, 'video': m}} for those of `dirs` that have been scanned."""
+        conn = self._conn()
+        counts = {}
+        dirs = list(dirs)
+        # Chunked to stay under SQLite's bound-parameter limit for large listings.
+        for i in range(0, len(dirs), 500):
+            chunk = dirs[i:i + 500]
+            placeholders = ','.join('?' * len(chunk))
+            for (dir_path,) in conn.execute(f'SELECT path FROM dirs WHERE path IN ({placeholders})', chunk):
+                counts[dir_path] = {'image': 0, 'video': 0}
+            for dir_path, kind, count in conn.execute(
+                    f'SELECT dir, type, COUNT(*) FROM media WHERE dir IN ({placeholders}) GROUP BY dir, type', chunk):
+                if dir_path in counts:
+                    counts[dir_path][kind] = count
+        return counts
+
+    def is_scanned(self, folder_path):
+        return self._conn().execute(
+            'SELECT 1 FROM folders WHERE path = ?', (folder_path,)).fetchone() is not None
+
+    # --- Video probes ---
+
+    def get_video_info(self, path, mtime, size):
+        """Returns the stored VideoInfo for a video, or None if it was never probed or has changed."""
+        row = self._conn().execute(
+            'SELECT width, height, duration, fps, codec FROM video_info WHERE path = ? AND mtime = ? AND size = ?',
+            (path, mtime, size)).fetchone()
+        return VideoInfo(*row) if row else None
+
+    def put_video_info(self, path, mtime, size, info):
+        conn = self._conn()
+        with conn:
+            conn.execute('INSERT OR REPLACE INTO video_info VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                         (path, mtime, size, *info))
+
+    # --- Image metadata ---
+
+    @staticmethod
+    def _meta_row(path, mtime, size, meta):
+        return (path, mtime, size, meta.width, meta.height, meta.model, meta.taken,
+                meta.lat, meta.lon, encode_tags(meta.tags))
+
+    def get_image_metadata(self, path, mtime, size):
+        """Returns the indexed ImageMetadata for an image, or None if it is missing or stale."""
+        row = self._conn().execute(
+            'SELECT width, height, model, taken, lat, lon, tags FROM image_meta '
+            'WHERE path = ? AND mtime = ? AND size = ?', (path, mtime, size)).fetchone()
+        if row is None:
+            return None
+        return ImageMetadata(*row[:6], json.loads(row[6]) if row[6] else {})
+
+    def put_image_metadata(self, path, mtime, size, meta):
+        """Stores metadata read outside a scan and keeps the file's sort key in step."""
+        conn = self._conn()
+        with conn:
+            conn.execute('INSERT OR REPLACE INTO image_meta VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                         self._meta_row(path, mtime, size, meta))
+            conn.execute('UPDATE media SET taken = ? WHERE path = ? AND mtime = ?',
+                         (meta.taken or mtime, path, mtime))
+
+    def get_coordinates(self, paths):
+        """Returns the (lat, lon) of those of the given images that are geotagged."""
+        conn = self._conn()
+        paths = list(paths)
+        rows = []
+        for i in range(0, len(paths), 500):
+            chunk = paths[i:i + 500]
+            rows.extend(conn.execute(
+                f"SELECT lat, lon FROM image_meta WHERE lat IS NOT NULL AND path IN ({','.join('?' * len(chunk))})",
+                chunk))
+        return rows
+
+    def folder_coordinates(self, folder_path):
+        """Returns the distinct (lat, lon) of every geotagged image in a folder."""
+        return self._conn().execute(
+            'SELECT DISTINCT i.lat, i.lon FROM image_meta i JOIN media m ON m.path = i.path '
+            'WHERE m.folder = ? AND i.lat IS NOT NULL', (folder_path,)).fetchall()
+
+    def geo_clusters(self, folders, south, west, north, east, cell_deg):
+        """Groups the geotagged images inside a bounding box into cell_deg-sized grid cells.
+
+        Returns (count, mean lat, mean lon, sample path) per non-empty cell.
+        A box with west > east crosses the antimeridian.
+        """
+        if not folders:
+            return []
+        lon_clause = 'i.lon BETWEEN ? AND ?' if west <= east else '(i.lon >= ? OR i.lon <= ?)'
+        # Offsets keep the cell numbers positive, so CAST truncation acts as floor().
+        return self._conn().execute(
+            'SELECT COUNT(*), AVG(i.lat), AVG(i.lon), MIN(i.path) FROM image_meta i '
+            'JOIN media m ON m.path = i.path '
+            f"WHERE i.lat BETWEEN ? AND ? AND {lon_clause} AND m.folder IN ({','.join('?' * len(folders))}) "
+            'GROUP BY CAST((i.lat + 90) / ? AS INTEGER), CAST((i.lon + 180) / ? AS INTEGER)',
+            [south, north, west, east, *folders, cell_deg, cell_deg]).fetchall()
+
+    # --- Perceptual hashes ---
+
+    def images_needing_hash(self, limit):
+        """Returns (path, mtime, size) for images with no hash for their current contents."""
+        return self._conn().execute(
+            "SELECT m.path, m.mtime, m.size FROM media m LEFT JOIN image_hash h ON h.path = m.path "
+            "WHERE m.type = 'image' AND (h.path IS NULL OR h.mtime != m.mtime OR h.size != m.size) "
+            'LIMIT ?', (limit,)).fetchall()
+
+    def put_hashes(self, rows):
+        """Stores (path, mtime, size, dhash) rows; a NULL dhash marks an unreadable image."""
+        conn = self._conn()
+        with conn:
+            conn.executemany('INSERT OR REPLACE INTO image_hash VALUES (?, ?, ?, ?)', rows)
+
+    def load_hashes(self, folders):
+        """Returns (path, filename, mtime, taken, size, dhash) for every hashed image in the folders."""
+        if not folders:
+            return []
+        return self._conn().execute(
+            'SELECT m.path, m.filename, m.mtime, m.taken, m.size, h.dhash FROM media m '
+            'JOIN image_hash h ON h.path = m.path AND h.mtime = m.mtime AND h.size = m.size '
+            f"WHERE h.dhash IS NOT NULL AND m.folder IN ({','.join('?' * len(folders))})",
+            list(folders)).fetchall()
+
+    def hash_counts(self, folders):
+        """Returns (images, hashed) counts across the given folders."""
+        if not folders:
+            return 0, 0
+        return self._conn().execute(
+            'SELECT COUNT(*), COUNT(h.path) FROM media m '
+            'LEFT JOIN image_hash h ON h.path = m.path AND h.mtime = m.mtime AND h.size = m.size '
+            f"WHERE m.type = 'image' AND m.folder IN ({','.join('?' * len(folders))})",
+            list(folders)).fetchone()
+
+    # --- Places (reverse-geocoding results) ---
+
+    def iter_places(self):
+        """Yields (lat, lon, address) for every resolved place."""
+        yield from self._conn().execute('SELECT lat, lon, address FROM places')
+
+    def get_place(self, key):
+        row = self._conn().execute('SELECT address FROM places WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def put_place(self, key, lat, lon, address):
+        conn = self._conn()
+        with conn:
+            conn.execute('INSERT OR REPLACE INTO places VALUES (?, ?, ?, ?, ?)',
+                         (key, lat, lon, address, time.time()))
+
+    def import_places(self, places):
+        """Bulk-loads {key: address} entries from the old JSON cache, keeping existing rows."""
+        rows = []
+        for key, address in places.items():
+            try:
+                lat, lon = (float(v) for v in key.split(','))
+            except ValueError:
+                continue
+            rows.append((key, lat, lon, address, None))
+        conn = self._conn()
+        with conn:
+            conn.executemany('INSERT OR IGNORE INTO places VALUES (?, ?, ?, ?, ?)', rows)
+        return len(rows)
@@ -0,0 +1,88 @@
+import os
+import copy
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+
+class ConfigStore:
+    """settings/config.json, kept in memory.
+
+    Reads are served from memory; the file is only stat'ed (at most every
+    `reload_interval` seconds) so hand edits are still picked up. Changes go
+    through edit(), which holds a lock across the read-modify-write so
+    concurrent requests can't overwrite each other's updates, and saves are
+    atomic (write a temp file, then rename over the original).
+    """
+
+    def __init__(self, path, defaults, reload_interval=1.0):
+        self.path = path
+        self.defaults = defaults
+        self.reload_interval = reload_interval
+        self._lock = threading.RLock()
+        self._config = None
+        self._signature = None # (mtime_ns, size) of the file the config was read from
+        self._last_check = 0.0
+
+    def _stat_signature(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def _refresh(self, force=False):
+        """Re-reads the file if it changed on disk. Called with the lock held."""
+        now = time.monotonic()
+        if self._config is not None and not force and now - self._last_check < self.reload_interval:
+            return
+        self._last_check = now
+        signature = self._stat_signature()
+        if self._config is not None and signature == self._signature:
+            return
+        config = copy.deepcopy(self.defaults)
+        if signature is not None:
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    config.update(json.load(f))
+            except (json.JSONDecodeError, OSError):
+                if self._config is not None:
+                    return # Keep the last good config rather than falling back to defaults
+        self._config = config
+        self._signature = signature
+
+    def load(self):
+        """Returns a copy of the whole configuration, with defaults for missing keys."""
+        with self._lock:
+            self._refresh()
+            return copy.deepcopy(self._config)
+
+    def get(self, key):
+        """Returns one setting; cheaper than load() on hot paths."""
+        with self._lock:
+            self._refresh()
+            return copy.deepcopy(self._config[key])
+
+    @contextmanager
+    def edit(self):
+        """Yields a copy of the configuration and saves it when the block exits without an error."""
+        with self._lock:
+            self._refresh(force=True)
+            config = copy.deepcopy(self._config)
+            yield config
+            self._write(config)
+
+    def save(self, config):
+        with self._lock:
+            self._write(copy.deepcopy(config))
+
+    def _write(self, config):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(config, f, indent=4)
+        os.replace(tmp_path, self.path)
+        self._config = config
+        self._signature = self._stat_signature()
+        self._last_check = time.monotonic()
@@ -0,0 +1,353 @@
+import os
+import threading
+import logging
+from itertools import combinations
+from math import comb
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+HASH_BATCH = 64 # Images per worker task; amortizes process round-trips
+MAX_PROBES = 5000 # Chunk values looked up per hash and chunk, at most
+PROBE_COST = 6 # A sorted-array lookup costs about this many hash comparisons
+PAIR_BLOCK = 1 << 21 # Candidate pairs compared per vectorized step
+# Popcount of every 16-bit value, for Hamming distances without a per-bit loop.
+POPCOUNT16 = np.array([bin(i).count('1') for i in range(1 << 16)], dtype=np.uint8)
+
+
+# --- Hashing (runs in worker processes) ---
+
+def _hash_input(path):
+    """Returns the 9x8 grayscale image a dHash is computed from, or None if unreadable."""
+    from thumbnails import open_image_for_thumbnail
+    try:
+        # Reduced-scale decode: the hash only needs a few dozen pixels.
+        img = open_image_for_thumbnail(path, (64, 64))
+        small = img.convert('L').resize((9, 8), Image.Resampling.LANCZOS, reducing_gap=2.0)
+    except Exception:
+        return None
+    return np.asarray(small, dtype=np.int16)
+
+
+def dhash_batch(paths):
+    """Worker-process entry point: returns a 64-bit difference hash (or None) for each path.
+
+    Each bit says whether a pixel is brighter than its right-hand neighbour,
+    which survives resizing, re-encoding and small edits. The comparison and
+    bit packing run over the whole batch at once.
+    """
+    grids = [_hash_input(path) for path in paths]
+    ok = [i for i, grid in enumerate(grids) if grid is not None]
+    hashes = [None] * len(paths)
+    if ok:
+        stack = np.stack([grids[i] for i in ok]) # (n, 8, 9)
+        bits = (stack[:, :, 1:] > stack[:, :, :-1]).reshape(len(ok), 64)
+        packed = np.packbits(bits, axis=1).view('>u8').ravel()
+        for i, value in zip(ok, packed):
+            hashes[i] = int(value)
+    return hashes
+
+
+def to_signed(value):
+    """SQLite integers are signed 64-bit; store hashes in that range."""
+    return value - (1 << 64) if value is not None and value >= 1 << 63 else value
+
+
+# --- Matching ---
+
+def hamming(a, b):
+    """Bitwise Hamming distance between uint64 arrays (broadcasting)."""
+    x = np.bitwise_xor(a, b)
+    return POPCOUNT16[x.view(np.uint16)].reshape(x.shape + (4,)).sum(axis=-1, dtype=np.uint8)
+
+
+def _chunks(count):
+    """Splits 64 bits into `count` contiguous (shift, width) ranges."""
+    widths = [64 // count + (1 if i < 64 % count else 0) for i in range(count)]
+    chunks = []
+    shift = 0
+    for width in widths:
+        chunks.append((shift, width))
+        shift += width
+    return chunks
+
+
+def _flips(width, radius):
+    """Every XOR mask of at most `radius` bits within `width` bits (the chunk values to probe)."""
+    return [sum(1 << bit for bit in bits) for r in range(radius + 1) for bits in combinations(range(width), r)]
+
+
+def _plan(n, max_distance):
+    """Picks the chunk count for multi-index hashing with the fewest expected comparisons.
+
+    With m chunks, two hashes within max_distance bits differ by at most
+    max_distance // m bits in some chunk (pigeonhole), so each hash probes
+    every chunk value within that radius of its own. More chunks mean
+    smaller radii but shorter chunks and so larger buckets; the estimate
+    assumes uniformly spread hash bits and counts one lookup as
+    PROBE_COST comparisons.
+    """
+    best = None
+    for count in range(1, max_distance + 2):
+        radius = max_distance // count
+        cost = 0
+        for _, width in _chunks(count):
+            probes = sum(comb(width, r) for r in range(radius + 1))
+            if probes > MAX_PROBES:
+                break
+            cost += probes * (PROBE_COST * n + n * n / 2 ** width)
+        else:
+            if best is None or cost < best[0]:
+                best = (cost, count, radius)
+    return best[1], best[2]
+
+
+def _probe_pairs(keys, sorted_keys, order, flip):
+    """Yields (a, b) index arrays of hashes whose chunk keys differ by exactly `flip`.
+
+    Both directions and self-pairs are dropped (a < b). Pairs are produced
+    in blocks of about PAIR_BLOCK so a crowded bucket can't exhaust memory.
+    """
+    probe = keys ^ np.uint64(flip)
+    left = np.searchsorted(sorted_keys, probe, side='left')
+    counts = np.searchsorted(sorted_keys, probe, side='right') - left
+    sources = np.flatnonzero(counts)
+    if not len(sources):
+        return
+    ends = np.cumsum(counts[sources])
+    cuts = np.searchsorted(ends, np.arange(PAIR_BLOCK, ends[-1], PAIR_BLOCK), side='right')
+    for block in np.split(sources, np.unique(cuts)):
+        if not len(block):
+            continue
+        block_counts = counts[block]
+        a = np.repeat(block, block_counts)
+        starts = np.cumsum(block_counts) - block_counts
+        b = order[np.repeat(left[block] - starts, block_counts) + np.arange(len(a))]
+        keep = a < b
+        yield a[keep], b[keep]
+
+
+def _components(n, a, b):
+    """Labels the connected components of a graph given as edge arrays (a[i], b[i])."""
+    labels = np.arange(n)
+    while True:
+        previous = labels.copy()
+        low = np.minimum(labels[a], labels[b])
+        np.minimum.at(labels, a, low)
+        np.minimum.at(labels, b, low)
+        # Pointer jumping: follow labels to their roots.
+        while True:
+            jumped = labels[labels]
+            if np.array_equal(jumped, labels):
+                break
+            labels = jumped
+        if np.array_equal(labels, previous):
+            return labels
+
+
+def find_duplicate_groups(hashes, max_distance):
+    """Groups hashes within max_distance bits of each other (transitively).
+
+    Multi-index hashing (see _plan): the 64 bits are split into chunks and,
+    per chunk, each hash looks up the hashes whose chunk value is within
+    the planned radius of its own in a sorted key array; only those
+    candidates get a vectorized XOR + popcount. Identical hashes are
+    merged up front so bursts of the same shot stay cheap. Returns lists
+    of indices into `hashes`, largest group first.
+    """
+    unique, inverse = np.unique(np.asarray(hashes, dtype=np.uint64), return_inverse=True)
+    inverse = inverse.ravel()
+    n = len(unique)
+    edges_a, edges_b = [], []
+    count, radius = _plan(n, max_distance)
+    for shift, width in _chunks(count):
+        keys = (unique >> np.uint64(shift)) & np.uint64((1 << width) - 1)
+        order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[order]
+        for flip in _flips(width, radius):
+            for a, b in _probe_pairs(keys, sorted_keys, order, flip):
+                close = hamming(unique[a], unique[b]) <= max_distance
+                edges_a.append(a[close])
+                edges_b.append(b[close])
+
+    labels = _components(n, np.concatenate(edges_a or [np.zeros(0, int)]),
+                         np.concatenate(edges_b or [np.zeros(0, int)]))[inverse]
+    _, label_index, counts = np.unique(labels, return_inverse=True, return_counts=True)
+    grouped = np.flatnonzero(counts[label_index.ravel()] > 1) # Drop the (many) singletons early
+    by_label = grouped[np.argsort(labels[grouped], kind='stable')]
+    bounds = np.flatnonzero(np.diff(labels[by_label])) + 1
+    groups = [group.tolist() for group in np.split(by_label, bounds)] if len(by_label) else []
+    return sorted(groups, key=len, reverse=True)
+
+
+# --- Background indexing ---
+
+class HashIndexer(threading.Thread):
+    """Hashes every image in the catalog in the background, in batches on a process pool.
+
+    Only images without a hash for their current mtime/size are picked up,
+    so a rescan after edits rehashes just the changed files. wake() is
+    hooked to the scanner; the pool is released whenever there is nothing
+    left to hash.
+
+    Duplicate groups are computed on this thread too, after hashing:
+    groups() returns the last result for a query and queues a new one when
+    hashes were stored since, so requests never wait for the matching.
+    """
+
+    def __init__(self, catalog, max_workers=None):
+        super().__init__(name='HashIndexer', daemon=True)
+        self.catalog = catalog
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self._wake = threading.Event()
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+        self._counts = {'hashed': 0, 'failed': 0}
+        self._running = False
+        self.generation = 0 # Bumped whenever hashes are written, to invalidate cached groups
+        self._groups = {} # (folders, max_distance) -> (generation, groups of catalog rows)
+        self._group_requests = set()
+        self._wake.set() # Catch up on anything left unhashed at startup
+
+    def wake(self, folder_path=None, result=None):
+        """Scanner hook: there may be new or modified images to hash, or removed ones to forget."""
+        if result is not None and (result.modified or result.removed):
+            self.invalidate() # Their old hashes no longer count
+        if result is None or result.added or result.modified:
+            self._wake.set()
+
+    def invalidate(self):
+        """Marks cached duplicate groups outdated, e.g. after files or a whole folder were removed."""
+        with self._lock:
+            self.generation += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self._wake.set()
+
+    def groups(self, folders, max_distance):
+        """Returns (groups of catalog rows or None, whether they reflect every stored hash).
+
+        A missing or outdated result is (re)computed in the background.
+        """
+        key = (tuple(folders), max_distance)
+        with self._lock:
+            cached = self._groups.get(key)
+            current = cached is not None and cached[0] == self.generation
+            if not current:
+                self._group_requests.add(key)
+        if not current:
+            self._wake.set()
+        return (cached[1] if cached is not None else None), current
+
+    def _group_pending(self):
+        while not self._stop_event.is_set():
+            with self._lock:
+                if not self._group_requests:
+                    return
+                key = self._group_requests.pop()
+                generation = self.generation
+            folders, max_distance = key
+            rows = self.catalog.load_hashes(folders)
+            # Stored signed; reinterpret as the unsigned 64-bit hash.
+            groups = find_duplicate_groups([row[5] & 0xFFFFFFFFFFFFFFFF for row in rows], max_distance)
+            groups = [[rows[i] for i in group] for group in groups]
+            with self._lock:
+                # Results from older generations are only worth keeping until they are recomputed.
+                self._groups = {k: v for k, v in self._groups.items() if v[0] == generation or k in self._group_requests}
+                self._groups[key] = (generation, groups)
+
+    def status(self):
+        with self._lock:
+            return dict(self._counts, running=self._running, workers=self.max_workers)
+
+    def _store(self, batch, hashes):
+        rows = []
+        for (path, mtime, size), value in zip(batch, hashes):
+            rows.append((path, mtime, size, to_signed(value)))
+        self.catalog.put_hashes(rows)
+        with self._lock:
+            self._counts['hashed'] += sum(1 for value in hashes if value is not None)
+            self._counts['failed'] += sum(1 for value in hashes if value is None)
+            self.generation += 1
+
+    def _hash_pending(self):
+        if not self.catalog.images_needing_hash(1):
+            return # Don't start worker processes for nothing
+        pool = None
+        in_flight = {}
+        seen = set()
+        suspects = [] # Batches lost with a crashed pool, retried alone and split until the culprit is found
+        try:
+            while not self._stop_event.is_set():
+                if pool is None:
+                    pool = ProcessPoolExecutor(max_workers=self.max_workers)
+                if suspects:
+                    # One at a time, so a crash is pinned on the batch that caused it.
+                    if not in_flight:
+                        batch = suspects.pop()
+                        in_flight[pool.submit(dhash_batch, [row[0] for row in batch])] = batch
+                elif len(in_flight) < self.max_workers * 2: # Keep a couple of batches per worker queued
+                    rows = [row for row in self.catalog.images_needing_hash(HASH_BATCH * self.max_workers * 2)
+                            if row[0] not in seen]
+                    for i in range(0, len(rows), HASH_BATCH):
+                        batch = rows[i:i + HASH_BATCH]
+                        seen.update(row[0] for row in batch)
+                        in_flight[pool.submit(dhash_batch, [row[0] for row in batch])] = batch
+                if not in_flight:
+                    return
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                broken = False
+                for future in done:
+                    batch = in_flight.pop(future)
+                    try:
+                        hashes = future.result()
+                    except BrokenProcessPool:
+                        broken = True
+                        self._crashed(batch, suspects)
+                        continue
+                    self._store(batch, hashes)
+                if broken:
+                    # Everything else in the pool is lost with it.
+                    wait(in_flight)
+                    for future, batch in in_flight.items():
+                        if future.exception() is None:
+                            self._store(batch, future.result())
+                        else:
+                            self._crashed(batch, suspects)
+                    in_flight.clear()
+                    pool.shutdown(wait=False)
+                    pool = None
+        finally:
+            if pool is not None:
+                pool.shutdown(wait=False, cancel_futures=True)
+
+    def _crashed(self, batch, suspects):
+        """Queues a batch lost with a crashed worker for another try, in halves; a single image is given up on."""
+        if len(batch) == 1:
+            logger.warning('Hash worker crashed on %s; skipping it', batch[0][0])
+            self._store(batch, [None]) # Stored as unreadable, so it isn't retried until it changes
+        else:
+            logger.warning('Hash worker pool broke; retrying %d images on a new pool', len(batch))
+            half = len(batch) // 2
+            suspects.extend([batch[half:], batch[:half]])
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self._wake.wait()
+            self._wake.clear()
+            with self._lock:
+                self._running = True
+            try:
+                self._hash_pending()
+            except Exception:
+                logger.exception('Perceptual hashing failed')
+            try:
+                self._group_pending()
+            except Exception:
+                logger.exception('Finding duplicate groups failed')
+            with self._lock:
+                self._running = False
@@ -0,0 +1,208 @@
+import time
+import threading
+import logging
+from collections import deque
+from geoindex import GridIndex
+from metrics import stage
+
+logger = logging.getLogger(__name__)
+
+NOT_FOUND = 'Location not found'
+
+
+def geo_key(lat, lon):
+    """The place-store key for a coordinate (about 1 m precision)."""
+    return f"{lat:.5f},{lon:.5f}"
+
+
+class NominatimGeocoder:
+    """Reverse-geocodes through OpenStreetMap's Nominatim service (geopy)."""
+
+    def __init__(self, language='ko', timeout=10):
+        self.language = language
+        self.timeout = timeout
+        self._geolocator = None
+
+    def reverse(self, lat, lon):
+        """Returns the address for a coordinate, or None if there is none."""
+        if self._geolocator is None:
+            from geopy.geocoders import Nominatim
+            self._geolocator = Nominatim(user_agent="photorium_app")
+        location = self._geolocator.reverse((lat, lon), language=self.language, timeout=self.timeout)
+        return location.address if location else None
+
+
+class StubGeocoder:
+    """An offline geocoder for tests and development; never touches the network.
+
+    Returns addresses from `places` ({geo_key: address}) and otherwise
+    describes the coordinate itself.
+    """
+
+    def __init__(self, places=None):
+        self.places = places or {}
+        self.calls = 0
+
+    def reverse(self, lat, lon):
+        self.calls += 1
+        return self.places.get(geo_key(lat, lon), f'{lat:.5f}, {lon:.5f}')
+
+
+GEOCODERS = {'nominatim': NominatimGeocoder, 'stub': StubGeocoder}
+
+
+class GeocodingWorker(threading.Thread):
+    """Resolves GPS coordinates to addresses in the background, one request at a time.
+
+    Requests never wait on the network: lookup() answers from the place
+    store and queues anything unknown. The queue is deduplicated, calls are
+    spaced at least `min_interval` seconds apart (Nominatim allows one per
+    second), and a rate-limit response pauses the worker for as long as the
+    service asks. Results are written to the store as they arrive.
+
+    With a `match_radius_m`, a place already resolved within that distance
+    is reused, so a burst of photos taken a few meters apart costs one
+    geocoder call instead of one per photo.
+    """
+
+    def __init__(self, store, geocoder, min_interval=1.0, max_attempts=3, match_radius_m=0):
+        super().__init__(name='GeocodingWorker', daemon=True)
+        # Has get_place(key), put_place(key, lat, lon, address) and iter_places()
+        self.store = store
+        self.geocoder = geocoder
+        self.min_interval = min_interval
+        self.max_attempts = max_attempts
+        self.match_radius_m = match_radius_m
+        self._index = None # GridIndex of resolved places, built on first use
+        self._index_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop_event = threading.Event()
+        self._queue = deque()
+        self._pending = {} # key -> failed attempts so far
+        self._failed = set() # keys given up on until the next restart
+        self._last_call = 0.0
+        self._counts = {'resolved': 0, 'reused': 0, 'errors': 0}
+
+    def _place_index(self):
+        with self._index_lock:
+            if self._index is None:
+                index = GridIndex(cell_m=max(self.match_radius_m, 10))
+                for lat, lon, address in self.store.iter_places():
+                    index.add(lat, lon, address)
+                self._index = index
+            return self._index
+
+    def find_place(self, lat, lon):
+        """Returns the stored address for a coordinate or, failing that, for the nearest one in range."""
+        address = self.store.get_place(geo_key(lat, lon))
+        if address is None and self.match_radius_m > 0:
+            match = self._place_index().nearest(lat, lon, self.match_radius_m)
+            if match is not None:
+                address = match[1]
+        return address
+
+    def lookup(self, lat, lon):
+        """Returns (status, address): 'resolved', 'pending' or 'failed'; queues unknown coordinates."""
+        key = geo_key(lat, lon)
+        address = self.find_place(lat, lon)
+        if address is not None:
+            return 'resolved', address
+        with self._lock:
+            if key in self._failed:
+                return 'failed', None
+        self.enqueue([(lat, lon)], urgent=True)
+        return 'pending', None
+
+    def enqueue(self, coordinates, urgent=False):
+        """Queues (lat, lon) pairs that are not resolved or queued yet.
+
+        Urgent entries (someone is looking at the photo) go to the front.
+        Returns the number of coordinates added.
+        """
+        unresolved = []
+        for lat, lon in coordinates:
+            if self.find_place(lat, lon) is None:
+                unresolved.append((geo_key(lat, lon), lat, lon))
+        added = 0
+        with self._lock:
+            for item in unresolved:
+                key = item[0]
+                if key in self._failed:
+                    continue
+                if key in self._pending:
+                    if urgent and item in self._queue:
+                        # Move it forward so the open info panel resolves first.
+                        self._queue.remove(item)
+                        self._queue.appendleft(item)
+                    continue
+                self._pending[key] = 0
+                if urgent:
+                    self._queue.appendleft(item)
+                else:
+                    self._queue.append(item)
+                added += 1
+        if added or urgent:
+            self._wake.set()
+        return added
+
+    def stop(self):
+        self._stop_event.set()
+        self._wake.set()
+
+    def status(self):
+        with self._lock:
+            return dict(self._counts, queued=len(self._queue), failed=len(self._failed),
+                        running=self.is_alive())
+
+    def _next(self):
+        with self._lock:
+            return self._queue.popleft() if self._queue else None
+
+    def _wait(self, seconds):
+        """Sleeps unless stopped; returns False if the worker should exit."""
+        return not self._stop_event.wait(seconds) if seconds > 0 else not self._stop_event.is_set()
+
+    def _resolve(self, key, lat, lon):
+        if self.find_place(lat, lon) is not None:
+            # A nearby point queued earlier has been resolved in the meantime.
+            with self._lock:
+                self._pending.pop(key, None)
+                self._counts['reused'] += 1
+            return
+        if not self._wait(self._last_call + self.min_interval - time.monotonic()):
+            return
+        self._last_call = time.monotonic()
+        try:
+            with stage('geocode'):
+                address = self.geocoder.reverse(lat, lon)
+        except Exception as e:
+            retry_after = getattr(e, 'retry_after', None) # geopy's GeocoderRateLimited
+            with self._lock:
+                self._counts['errors'] += 1
+                attempts = self._pending.get(key, 0) + 1
+                if retry_after or attempts < self.max_attempts:
+                    self._pending[key] = attempts
+                    self._queue.append((key, lat, lon))
+                else:
+                    self._pending.pop(key, None)
+                    self._failed.add(key)
+            logger.warning('Reverse geocoding %s failed: %s', key, e)
+            # Back off: honour the service's Retry-After, else grow with each failure.
+            self._wait(retry_after or self.min_interval * 2 ** attempts)
+            return
+        self.store.put_place(key, lat, lon, address or NOT_FOUND)
+        if self.match_radius_m > 0:
+            self._place_index().add(lat, lon, address or NOT_FOUND)
+        with self._lock:
+            self._pending.pop(key, None)
+            self._counts['resolved'] += 1
+
+    def run(self):
+        while not self._stop_event.is_set():
+            item = self._next()
+            if item is None:
+                self._wake.wait()
+                self._wake.clear()
+                continue
+            self._resolve(*item)
@@ -0,0 +1,58 @@
+import math
+import threading
+
+EARTH_RADIUS_M = 6371000.0
+METERS_PER_DEGREE = 111320.0 # Along a meridian; a degree of longitude shrinks with cos(lat)
+
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    """Great-circle distance between two coordinates in meters."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+class GridIndex:
+    """An in-memory spatial index that buckets points into fixed lat/lon cells.
+
+    A radius query only looks at the cells that can hold a match, so it
+    costs the same whether the index holds a hundred points or a million.
+    Cells are `cell_m` meters tall; queries should use radii of about that
+    size or smaller to stay within a few cells.
+    """
+
+    def __init__(self, cell_m=100.0):
+        self.cell_deg = cell_m / METERS_PER_DEGREE
+        self._cells = {} # (row, col) -> [(lat, lon, value), ...]
+        self._lock = threading.Lock()
+        self._count = 0
+
+    def _cell(self, lat, lon):
+        return int(math.floor(lat / self.cell_deg)), int(math.floor(lon / self.cell_deg))
+
+    def add(self, lat, lon, value):
+        with self._lock:
+            self._cells.setdefault(self._cell(lat, lon), []).append((lat, lon, value))
+            self._count += 1
+
+    def __len__(self):
+        return self._count
+
+    def nearest(self, lat, lon, radius_m):
+        """Returns (distance_m, value) of the closest point within radius_m, or None."""
+        row, col = self._cell(lat, lon)
+        row_span = int(math.ceil(radius_m / METERS_PER_DEGREE / self.cell_deg))
+        # Longitude cells get narrower towards the poles, so more of them fit in the radius.
+        cos_lat = max(math.cos(math.radians(lat)), 0.01)
+        col_span = int(math.ceil(radius_m / (METERS_PER_DEGREE * cos_lat) / self.cell_deg))
+        best = None
+        with self._lock:
+            for r in range(row - row_span, row + row_span + 1):
+                for c in range(col - col_span, col + col_span + 1):
+                    for p_lat, p_lon, value in self._cells.get((r, c), ()):
+                        distance = haversine_m(lat, lon, p_lat, p_lon)
+                        if distance <= radius_m and (best is None or distance < best[0]):
+                            best = (distance, value)
+        return best
@@ -6,8 +6,8 @@ import webbrowser
 import logging
 import os
 import subprocess
-from waitress import serve
-from app import app
+import time
+import metrics
 
 # --- Log Redirection ---
 class TextRedirector:
@@ -24,27 +24,110 @@ class TextRedirector:
     def flush(self):
         pass
 
-class NoQueueDepthFilter(logging.Filter):
-    """A custom filter to exclude 'Task queue depth' warnings."""
-    def filter(self, record):
-        # Return False to prevent messages containing this string from being logged.
-        return 'Task queue depth' not in record.getMessage()
+# --- Live Summary ---
+SUMMARY_REFRESH_MS = 1000
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
+
+def format_latency(seconds):
+    """Histogram quantiles are bucket bounds, hence the '<'."""
+    if seconds is None:
+        return "-"
+    if seconds == float('inf'):
+        return ">10 s"
+    return f"<{seconds * 1000:.0f} ms"
+
+def format_summary(current, previous, interval):
+    """Renders a metrics.summary() snapshot; rates are over the last refresh interval."""
+    rate = (current['requests'] - previous['requests']) / interval if previous else 0.0
+    lines = [
+        f"Uptime {format_duration(current['uptime'])}   {current['requests']} requests ({rate:.1f}/s)   "
+        f"{current['errors']} errors   {current['bytes'] / (1024 * 1024):.1f} MB served",
+        "",
+        f"{'Endpoint':<28}{'Requests':>10}{'/s':>8}{'Mean':>10}{'p50':>10}{'p95':>10}",
+    ]
+    busiest = sorted(current['endpoints'].items(), key=lambda item: item[1]['count'], reverse=True)
+    for name, entry in busiest:
+        before = previous['endpoints'].get(name, {}).get('count', 0) if previous else entry['count']
+        mean_ms = entry['seconds'] * 1000 / entry['count'] if entry['count'] else 0
+        lines.append(f"{name:<28}{entry['count']:>10}{(entry['count'] - before) / interval:>8.1f}"
+                     f"{mean_ms:>8.1f}ms{format_latency(entry['p50']):>10}{format_latency(entry['p95']):>10}")
+    if current['caches']:
+        lines += ["", "Caches"]
+        for name, results in sorted(current['caches'].items()):
+            lookups = sum(results.values())
+            hits = results.get('hit', 0) + results.get('not_modified', 0)
+            detail = ", ".join(f"{result} {count}" for result, count in sorted(results.items()))
+            lines.append(f"  {name:<18}{hits * 100 / lookups:5.1f}% hits   ({detail})")
+    if current['stages']:
+        lines += ["", "Stages (mean)"]
+        for name, (count, mean) in sorted(current['stages'].items()):
+            lines.append(f"  {name:<18}{mean * 1000:8.1f} ms   x{count}")
+    return "\n".join(lines)
+
+class SummaryView:
+    """Swaps the log for a live metrics summary, refreshed every second while shown."""
+    def __init__(self, root, log_text, summary_text, button):
+        self.root = root
+        self.log_text = log_text
+        self.summary_text = summary_text
+        self.button = button
+        self.visible = False
+        self.previous = None
+
+    def toggle(self):
+        self.visible = not self.visible
+        if self.visible:
+            self.log_text.pack_forget()
+            self.summary_text.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+            self.button.configure(text="Show Log")
+            self.previous = None
+            self.refresh()
+        else:
+            self.summary_text.pack_forget()
+            self.log_text.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+            self.button.configure(text="Show Summary")
+
+    def refresh(self):
+        if not self.visible:
+            return
+        current = metrics.summary()
+        text = format_summary(current, self.previous, SUMMARY_REFRESH_MS / 1000)
+        self.previous = current
+        self.summary_text.configure(state='normal')
+        self.summary_text.delete('1.0', tk.END)
+        self.summary_text.insert(tk.END, text)
+        self.summary_text.configure(state='disabled')
+        self.root.after(SUMMARY_REFRESH_MS, self.refresh)
 
 # --- Server Control ---
 server_thread = None
 
-def run_server_thread(log_widget):
-    """Runs the Waitress server in a separate thread."""
+def run_server_thread(log_widget, handler):
+    """Loads the app and runs the Waitress server in a separate thread."""
     # This function will now be simpler. We let Flask's default logging
     # (which goes to stderr, and thus our redirector) handle messages.
     # Waitress's own noisy logs are suppressed by not configuring a logger for it.
     try:
-        serve(app, host='127.0.0.1', port=5000)
+        # Imported here rather than at the top so the window shows up at once.
+        started = time.perf_counter()
+        from app import app, start_background_services, create_wsgi_server
+        print(f"Application loaded in {time.perf_counter() - started:.2f} s\n")
+
+        # Configure Flask's logger to use the GUI's handler
+        app.logger.setLevel(logging.DEBUG)
+        app.logger.addHandler(handler)
+
+        start_background_services()
+        create_wsgi_server().run()
     except Exception as e:
         # This will be caught by the TextRedirector for stderr
         print(f"Server failed to start: {e}\n")
 
-def start_server(log_widget):
+def start_server(log_widget, handler):
     """Starts the server thread."""
     global server_thread
     if server_thread and server_thread.is_alive():
@@ -53,10 +136,10 @@ def start_server(log_widget):
         log_widget.configure(state='disabled')
         return
 
-    server_thread = threading.Thread(target=run_server_thread, args=(log_widget,), daemon=True)
+    server_thread = threading.Thread(target=run_server_thread, args=(log_widget, handler), daemon=True)
     server_thread.start()
     log_widget.configure(state='normal')
-    log_widget.insert(tk.END, "Photorium server started at http://127.0.0.1:5000\n")
+    log_widget.insert(tk.END, "Starting Photorium server...\n")
     log_widget.configure(state='disabled')
 
 def restart_server():
@@ -107,6 +190,9 @@ def main():
     shutdown_btn = tk.Button(button_frame, text="Shutdown Server", command=lambda: shutdown_app(root))
     shutdown_btn.pack(side=tk.LEFT)
 
+    summary_btn = tk.Button(button_frame, text="Show Summary")
+    summary_btn.pack(side=tk.RIGHT)
+
     # --- Log Frame ---
     log_frame = tk.LabelFrame(main_frame, text="Server Log")
     log_frame.pack(fill=tk.BOTH, expand=True)
@@ -114,6 +200,11 @@ def main():
     log_text = scrolledtext.ScrolledText(log_frame, wrap=tk.WORD, state='disabled', bg="#f0f0f0")
     log_text.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
 
+    # Live request/cache/stage summary, shown in place of the log on demand
+    summary_text = tk.Text(log_frame, wrap=tk.NONE, state='disabled', bg="#f0f0f0", font=("Courier", 9))
+    summary_view = SummaryView(root, log_text, summary_text, summary_btn)
+    summary_btn.configure(command=summary_view.toggle)
+
     # Redirect stdout and stderr to the log widget
     sys.stdout = TextRedirector(log_text)
     sys.stderr = TextRedirector(log_text)
@@ -124,18 +215,15 @@ def main():
     # Set a format for the logs
     handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
 
-    # Configure the waitress logger to use our handler and filter
+    # Configure the waitress logger to use our handler. 'Task queue depth'
+    # warnings are kept: they mean every request thread is busy, and
+    # /api/server_status shows which pool is saturated.
     waitress_logger = logging.getLogger('waitress')
     waitress_logger.setLevel(logging.INFO)
     waitress_logger.addHandler(handler)    # Also send waitress logs to our GUI
-    waitress_logger.addFilter(NoQueueDepthFilter()) # Add the custom filter
-
-    # Configure Flask's logger to use the same handler
-    app.logger.setLevel(logging.DEBUG)
-    app.logger.addHandler(handler)
 
-    # Start the server automatically
-    start_server(log_text)
+    # Start the server automatically, once the window has been drawn
+    root.after_idle(start_server, log_text, handler)
 
     # Ensure the server thread is handled on exit
     root.protocol("WM_DELETE_WINDOW", lambda: shutdown_app(root))
@@ -143,4 +231,7 @@ def main():
     root.mainloop()
 
 if __name__ == '__main__':
+    # Needed for the thumbnail worker processes in the frozen (PyInstaller) executable.
+    import multiprocessing
+    multiprocessing.freeze_support()
     main()
\ No newline at end of file
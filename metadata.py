@@ -0,0 +1,107 @@
+import json
+from collections import namedtuple
+from datetime import datetime
+from PIL import Image, ExifTags
+from metrics import stage
+
+# width/height in px, taken as a Unix timestamp (DateTimeOriginal), lat/lon in
+# decimal degrees, tags as the JSON-safe {tag name: value} dict /api/exif returns.
+ImageMetadata = namedtuple('ImageMetadata', ['width', 'height', 'model', 'taken', 'lat', 'lon', 'tags'])
+
+EXIF_DATE_FORMAT = '%Y:%m:%d %H:%M:%S'
+
+
+def _to_float(value):
+    if hasattr(value, 'numerator') and hasattr(value, 'denominator'):
+        return float(value.numerator) / float(value.denominator)
+    return float(value)
+
+
+def gps_coordinates(gps_info):
+    """Converts an EXIF GPSInfo dict to (lat, lon) in decimal degrees, or None if incomplete."""
+    lat_ref, lat_val = gps_info.get(1), gps_info.get(2)
+    lon_ref, lon_val = gps_info.get(3), gps_info.get(4)
+    if lat_val is None or lon_val is None:
+        return None
+    try:
+        lat = _to_float(lat_val[0]) + _to_float(lat_val[1]) / 60 + _to_float(lat_val[2]) / 3600
+        lon = _to_float(lon_val[0]) + _to_float(lon_val[1]) / 60 + _to_float(lon_val[2]) / 3600
+    except (TypeError, ValueError, IndexError, ZeroDivisionError):
+        return None
+    if lat_ref == 'S': lat = -lat
+    if lon_ref == 'W': lon = -lon
+    return lat, lon
+
+
+def capture_time(exif):
+    """Returns DateTimeOriginal (falling back to DateTime) as a Unix timestamp, or None.
+
+    EXIF times carry no zone unless OffsetTimeOriginal is present, so they
+    are read as local time, the same way file mtimes are displayed.
+    """
+    value = exif.get('DateTimeOriginal') or exif.get('DateTime')
+    if not isinstance(value, str):
+        return None
+    try:
+        taken = datetime.strptime(value.strip('\x00').strip(), EXIF_DATE_FORMAT)
+    except ValueError:
+        return None
+    offset = exif.get('OffsetTimeOriginal')
+    if isinstance(offset, str):
+        try:
+            taken = taken.replace(tzinfo=datetime.strptime(offset.strip('\x00'), '%z').tzinfo)
+        except ValueError:
+            pass
+    try:
+        return taken.timestamp()
+    except (OverflowError, OSError, ValueError):
+        return None
+
+
+def json_safe_tags(exif_data):
+    """Names the tags and turns their values into JSON-safe types."""
+    decoded_exif = {}
+    for k, v in exif_data.items():
+        tag_name = ExifTags.TAGS.get(k, k)
+        # Decode bytes to string if possible
+        if isinstance(v, bytes):
+            try:
+                v = v.decode(errors='ignore').strip('\x00')
+            except Exception:
+                v = repr(v)
+        # Convert non-serializable types to string
+        if not isinstance(v, (str, int, float, bool, type(None))):
+            v = str(v)
+        decoded_exif[str(tag_name)] = v
+    return decoded_exif
+
+
+def read_image_metadata(path):
+    """Reads an image's dimensions and EXIF data without decoding any pixels.
+
+    Returns an ImageMetadata, or None if the file can't be opened.
+    """
+    try:
+        with stage('exif'), Image.open(path) as img:
+            width, height = img.size
+            exif_data = img._getexif() if hasattr(img, '_getexif') else None
+    except Exception:
+        return None
+    if not exif_data:
+        return ImageMetadata(width, height, None, None, None, None, {})
+
+    exif = {ExifTags.TAGS[k]: v for k, v in exif_data.items() if k in ExifTags.TAGS}
+    coordinates = None
+    if isinstance(exif.get('GPSInfo'), dict):
+        coordinates = gps_coordinates(exif['GPSInfo'])
+    lat, lon = coordinates or (None, None)
+    model = exif.get('Model')
+    if isinstance(model, bytes):
+        model = model.decode(errors='ignore')
+    if isinstance(model, str):
+        model = model.strip('\x00').strip() or None
+    return ImageMetadata(width, height, model, capture_time(exif), lat, lon, json_safe_tags(exif_data))
+
+
+def encode_tags(tags):
+    return json.dumps(tags, ensure_ascii=False, separators=(',', ':'))
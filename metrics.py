@@ -0,0 +1,282 @@
+import io
+import os
+import time
+import bisect
+import pstats
+import cProfile
+import logging
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds; request latencies and pipeline stages share them.
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+class Counter:
+    """A monotonically increasing value per label combination."""
+
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def values(self):
+        """Returns {label values: count}."""
+        with self._lock:
+            return dict(self._values)
+
+    def render(self):
+        return [f'{self.name}{_format_labels(self.labels, key)} {value}'
+                for key, value in sorted(self.values().items())]
+
+
+class Histogram:
+    """Bucketed observations per label combination, like a Prometheus histogram."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series = {} # label values -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def series(self):
+        """Returns {label values: (per-bucket counts, count, sum)}; counts are not cumulative."""
+        with self._lock:
+            return {key: (s[:-1], sum(s[:-1]), s[-1]) for key, s in self._series.items()}
+
+    def quantile(self, q, counts):
+        """Estimates a quantile from per-bucket counts (the upper bound of the bucket it falls in)."""
+        total = sum(counts)
+        if not total:
+            return None
+        rank = q * total
+        seen = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def render(self):
+        lines = []
+        for key, (counts, total, value_sum) in sorted(self.series().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{self.name}_bucket{_format_labels(self.labels, key, [("le", le)])} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labels, key)} {value_sum}')
+            lines.append(f'{self.name}_count{_format_labels(self.labels, key)} {total}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.started = time.time()
+
+    def counter(self, name, help_text, labels=()):
+        metric = Counter(name, help_text, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        metric = Histogram(name, help_text, labels, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self, gauges=()):
+        """Returns every metric in the Prometheus text exposition format.
+
+        `gauges` adds point-in-time values read by the caller, as
+        (name, help, value) triples.
+        """
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.render())
+        gauges = [('photorium_uptime_seconds', 'Seconds since the server started.', time.time() - self.started),
+                  *gauges]
+        for name, help_text, value in gauges:
+            if value is None:
+                continue
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} gauge')
+            lines.append(f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+REQUEST_SECONDS = REGISTRY.histogram(
+    'photorium_http_request_duration_seconds', 'Time to produce a response, per endpoint.', ('endpoint', 'method'))
+REQUESTS = REGISTRY.counter(
+    'photorium_http_requests_total', 'Responses sent, per endpoint and status code.', ('endpoint', 'method', 'status'))
+RESPONSE_BYTES = REGISTRY.counter(
+    'photorium_http_response_bytes_total', 'Response body bytes sent, streamed responses included.', ('endpoint',))
+CACHE_LOOKUPS = REGISTRY.counter(
+    'photorium_cache_lookups_total', 'Cache lookups by cache and result (hit, miss, not_modified, ...).',
+    ('cache', 'result'))
+STAGE_SECONDS = REGISTRY.histogram(
+    'photorium_stage_duration_seconds', 'Time spent in pipeline stages such as decode, encode and geocode.',
+    ('stage',))
+
+
+# --- Stage timing ---
+
+_local = threading.local()
+
+
+@contextmanager
+def stage(name):
+    """Times a block as pipeline stage `name`.
+
+    In a worker process started through run_with_stages() the timing is
+    collected and shipped back with the result; elsewhere it is recorded
+    right away.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        collected = getattr(_local, 'stages', None)
+        if collected is not None:
+            collected.append((name, elapsed))
+        else:
+            STAGE_SECONDS.observe(elapsed, stage=name)
+
+
+def run_with_stages(fn, *args):
+    """Worker-process entry point: runs fn(*args) and returns (result, [(stage, seconds), ...])."""
+    _local.stages = []
+    try:
+        return fn(*args), _local.stages
+    finally:
+        _local.stages = None
+
+
+def record_stages(stages):
+    """Records stage timings returned by run_with_stages in this (the server's) process."""
+    for name, elapsed in stages:
+        STAGE_SECONDS.observe(elapsed, stage=name)
+
+
+# --- Summary (for the GUI) ---
+
+def summary():
+    """Returns per-endpoint totals and latency estimates plus cache hit rates and stage means."""
+    endpoints = {}
+    for (endpoint, method), (counts, total, value_sum) in REQUEST_SECONDS.series().items():
+        entry = endpoints.setdefault(endpoint, {'count': 0, 'seconds': 0.0, 'counts': None})
+        entry['count'] += total
+        entry['seconds'] += value_sum
+        entry['counts'] = counts if entry['counts'] is None else [a + b for a, b in zip(entry['counts'], counts)]
+    for entry in endpoints.values():
+        entry['p50'] = REQUEST_SECONDS.quantile(0.5, entry['counts'])
+        entry['p95'] = REQUEST_SECONDS.quantile(0.95, entry['counts'])
+        del entry['counts']
+    errors = sum(v for (_, _, status), v in REQUESTS.values().items() if status.startswith('5'))
+    caches = {}
+    for (cache, result), count in CACHE_LOOKUPS.values().items():
+        caches.setdefault(cache, {})[result] = count
+    stages = {name: (total, value_sum / total if total else 0.0)
+              for (name,), (_, total, value_sum) in STAGE_SECONDS.series().items()}
+    return {
+        'uptime': time.time() - REGISTRY.started,
+        'requests': sum(e['count'] for e in endpoints.values()),
+        'errors': errors,
+        'bytes': sum(RESPONSE_BYTES.values().values()),
+        'endpoints': endpoints,
+        'caches': caches,
+        'stages': stages,
+    }
+
+
+# --- Slow-request profiling ---
+
+class SlowRequestProfiler:
+    """Opt-in cProfile sampling: profiles one request at a time and keeps the slow ones.
+
+    Every `sample_every`-th request (when no other is being profiled) runs
+    under cProfile; if it took at least `slow_ms`, its stats are written to
+    out_dir as a .prof file (open with pstats or snakeviz) and the top
+    functions are logged. Profiling one request at a time keeps the
+    overhead bounded and avoids clashing profilers on Python 3.12+.
+    """
+
+    def __init__(self, out_dir, top=15):
+        self.out_dir = out_dir
+        self.top = top
+        self._lock = threading.Lock()
+        self._active = False
+        self._seen = 0
+
+    def start(self, sample_every):
+        """Returns a running profiler for this request, or None if it is not sampled."""
+        with self._lock:
+            self._seen += 1
+            if self._active or self._seen % max(1, sample_every):
+                return None
+            self._active = True
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError: # Another profiler (e.g. a debugger) is already active
+            with self._lock:
+                self._active = False
+            return None
+        return profiler
+
+    def finish(self, profiler, elapsed, slow_ms, label):
+        """Stops the profiler and dumps its stats if the request was slow."""
+        profiler.disable()
+        with self._lock:
+            self._active = False
+        if elapsed * 1000 < slow_ms:
+            return None
+        os.makedirs(self.out_dir, exist_ok=True)
+        safe_label = ''.join(c if c.isalnum() else '_' for c in label)[:60]
+        path = os.path.join(self.out_dir, f'{time.strftime("%Y%m%d-%H%M%S")}-{int(elapsed * 1000)}ms-{safe_label}.prof')
+        profiler.dump_stats(path)
+        try:
+            out = io.StringIO()
+            pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(self.top)
+            logger.warning('Slow request %s took %.0f ms; profile saved to %s\n%s',
+                           label, elapsed * 1000, path, out.getvalue())
+        except Exception:
+            logger.exception('Could not summarize profile %s', path)
+        return path
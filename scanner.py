@@ -0,0 +1,132 @@
+import threading
+import time
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class FolderScanner(threading.Thread):
+    """Keeps the catalog in sync with the configured folders in the background.
+
+    The first pass re-reads every folder. Later passes poll directory mtimes
+    and only re-read folders whose contents changed, with a forced full pass
+    every `full_rescan_seconds` to pick up files edited in place. Folders
+    passed to request_scan() jump the queue, so a newly added collection is
+    indexed without blocking the request that added it.
+
+    Subscribers registered with subscribe() are called as
+    callback(folder, ScanResult) for every folder that had changes.
+    """
+
+    def __init__(self, catalog, get_folders, interval=30.0, full_rescan_seconds=3600.0):
+        super().__init__(name='FolderScanner', daemon=True)
+        self.catalog = catalog
+        self.get_folders = get_folders # Returns the configured folders as dicts with a 'path' key
+        self.interval = interval
+        self.full_rescan_seconds = full_rescan_seconds
+        self._wake = threading.Event()
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+        self._pending = deque()
+        self._subscribers = []
+        self._last_full_scan = None
+        self._status = {
+            'phase': 'starting',
+            'current_folder': None,
+            'folders_done': 0,
+            'folders_total': 0,
+            'last_pass_started': None,
+            'last_pass_finished': None,
+            'last_pass_duration': None,
+        }
+
+    def subscribe(self, callback):
+        self._subscribers.append(callback)
+
+    def request_scan(self, folder_path):
+        """Queues a forced scan of one folder ahead of the regular passes."""
+        with self._lock:
+            if folder_path not in self._pending:
+                self._pending.append(folder_path)
+        self._wake.set()
+
+    def stop(self):
+        self._stop_event.set()
+        self._wake.set()
+
+    def status(self):
+        with self._lock:
+            status = dict(self._status)
+            status['pending'] = list(self._pending)
+        status['running'] = self.is_alive()
+        status['last_full_scan'] = self._last_full_scan
+        return status
+
+    def _set_status(self, **changes):
+        with self._lock:
+            self._status.update(changes)
+
+    def _pop_pending(self):
+        with self._lock:
+            return self._pending.popleft() if self._pending else None
+
+    def scan_folder(self, folder_path, force=True):
+        """Syncs one configured folder right away and notifies subscribers of changes."""
+        folders = {f['path']: f for f in self.get_folders()}
+        folder_info = folders.get(folder_path)
+        if folder_info is None:
+            return
+        self._set_status(current_folder=folder_path)
+        try:
+            result = self.catalog.sync_folder(
+                folder_path, force=force,
+                recursive=folder_info.get('recursive', False),
+                max_depth=folder_info.get('max_depth'),
+                exclude=folder_info.get('exclude') or (),
+                # Nested collections are indexed on their own, never twice.
+                skip_dirs=[p for p in folders if p != folder_path])
+        except Exception:
+            logger.exception('Scanning %s failed', folder_path)
+            return
+        if folder_path not in {f['path'] for f in self.get_folders()}:
+            # The folder was removed while it was being scanned.
+            self.catalog.remove_folder(folder_path)
+            return
+        if result and (result.added or result.modified or result.removed):
+            for callback in self._subscribers:
+                try:
+                    callback(folder_path, result)
+                except Exception:
+                    logger.exception('Scan subscriber failed for %s', folder_path)
+
+    def _drain_pending(self):
+        folder_path = self._pop_pending()
+        while folder_path is not None:
+            self.scan_folder(folder_path, force=True)
+            folder_path = self._pop_pending()
+
+    def _run_pass(self):
+        full = self._last_full_scan is None or time.time() - self._last_full_scan >= self.full_rescan_seconds
+        folders = [f['path'] for f in self.get_folders()]
+        started = time.time()
+        self._set_status(phase='full' if full else 'incremental', folders_done=0,
+                         folders_total=len(folders), last_pass_started=started)
+        for i, folder_path in enumerate(folders):
+            if self._stop_event.is_set():
+                return
+            self._drain_pending()
+            self.scan_folder(folder_path, force=full)
+            self._set_status(folders_done=i + 1)
+        if full:
+            self._last_full_scan = started
+        finished = time.time()
+        self._set_status(phase='idle', current_folder=None, last_pass_finished=finished,
+                         last_pass_duration=finished - started)
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self._drain_pending()
+            self._run_pass()
+            self._wake.wait(self.interval)
+            self._wake.clear()
@@ -0,0 +1,106 @@
+import mimetypes
+from datetime import datetime, timezone
+from flask import request, current_app
+from werkzeug.http import is_resource_modified
+
+# Responses for content-addressed URLs (?v= matching the file) never need revalidation.
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+CHUNK_SIZE = 256 * 1024
+
+
+def media_etag(st):
+    """A strong ETag from the file's inode, size and mtime; any change to the file changes it."""
+    return f'{st.st_ino:x}-{st.st_size:x}-{st.st_mtime_ns:x}'
+
+
+def media_version(mtime, size):
+    """The ?v= token put in media URLs; computed from the catalog's mtime and size."""
+    return f'{int(mtime * 1000000):x}-{size:x}'
+
+
+def _iter_range(f, length):
+    """Yields `length` bytes from the current file position, then closes the file."""
+    try:
+        while length > 0:
+            data = f.read(min(CHUNK_SIZE, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+    finally:
+        f.close()
+
+
+def _range_applies(etag, st):
+    """Honours If-Range: the Range header only counts if the client's copy is current."""
+    if_range = request.if_range
+    if if_range.etag is not None:
+        return if_range.etag == etag
+    if if_range.date is not None:
+        return int(st.st_mtime) <= if_range.date.timestamp()
+    return True
+
+
+def set_cache_policy(response, st, version):
+    """Marks responses to content-addressed URLs immutable; everything else revalidates."""
+    if version is not None and version == media_version(st.st_mtime, st.st_size):
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+
+
+def send_media(path, st, version=None, mimetype=None):
+    """Serves a media file with validators, byte ranges and zero-copy delivery.
+
+    `st` is the file's stat result. When `version` is given and matches the
+    file, the URL is content-addressed and the response is cached as
+    immutable; otherwise clients revalidate with the ETag. Single byte
+    ranges get a 206 (players request these when seeking). Under waitress
+    the body is handed over as wsgi.file_wrapper, so the file is streamed by
+    the server itself instead of being iterated in Python.
+    """
+    etag = media_etag(st)
+    response = current_app.response_class(
+        mimetype=mimetype or mimetypes.guess_type(path)[0] or 'application/octet-stream')
+    response.set_etag(etag)
+    response.last_modified = st.st_mtime
+    response.accept_ranges = 'bytes'
+    set_cache_policy(response, st, version)
+
+    last_modified = datetime.fromtimestamp(st.st_mtime, timezone.utc)
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response.status_code = 304
+        return response
+
+    start, stop = 0, st.st_size
+    byte_range = request.range
+    # Multi-range requests are rare for media; answering them with the whole file is allowed.
+    if byte_range is not None and len(byte_range.ranges) == 1 and _range_applies(etag, st):
+        bounds = byte_range.range_for_length(st.st_size)
+        if bounds is None:
+            response.status_code = 416
+            response.headers['Content-Range'] = f'bytes */{st.st_size}'
+            return response
+        start, stop = bounds
+        response.status_code = 206
+        response.headers['Content-Range'] = f'bytes {start}-{stop - 1}/{st.st_size}'
+
+    length = stop - start
+    response.content_length = length
+    if request.method == 'HEAD':
+        return response
+
+    f = open(path, 'rb')
+    f.seek(start)
+    file_wrapper = request.environ.get('wsgi.file_wrapper')
+    # A generic file_wrapper sends everything up to EOF; waitress's stops at
+    # Content-Length (it has prepare()), so it can serve any range.
+    if file_wrapper is not None and (stop == st.st_size or hasattr(file_wrapper, 'prepare')):
+        response.response = file_wrapper(f, CHUNK_SIZE)
+    else:
+        response.response = _iter_range(f, length)
+    response.direct_passthrough = True
+    return response
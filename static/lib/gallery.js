@@ -59,75 +59,145 @@ document.addEventListener('DOMContentLoaded', () => {
         });
     }, { rootMargin: "200px" }); // Use a margin to avoid flickering on fast scrolls
 
-    async function loadImages() {
-        try {
-            const response = await fetch('/api/images');
-            if (!response.ok) throw new Error('Failed to load images.');
-            allImages = await response.json();
-
-            galleryGrid.innerHTML = ''; // Clear previous content
-            if (allImages.length === 0) {
-                galleryGrid.innerHTML = '<p>No images found in your collections.</p>';
-                return;
-            }
+    // --- Thumbnail sizing ---
+    // The server renders thumbnails in a few fixed sizes; ask for the smallest
+    // one that covers a grid cell at this screen's pixel density.
+    const THUMBNAIL_BUCKETS = [128, 256, 512, 1024];
+    let thumbnailSize = 256;
+    let sortKey = 'mtime'; // 'mtime' or 'taken' (EXIF capture time), from settings
+
+    function thumbnailBucket(gridSize) {
+        const pixels = gridSize * (window.devicePixelRatio || 1);
+        return THUMBNAIL_BUCKETS.find(bucket => bucket >= pixels) || THUMBNAIL_BUCKETS[THUMBNAIL_BUCKETS.length - 1];
+    }
 
-            // --- Calculate and Display Stats ---
-            const totalImages = allImages.filter(m => m.type === 'image').length;
-            const totalVideos = allImages.filter(m => m.type === 'video').length;
-            if (galleryStats) {
-                galleryStats.textContent = `Total: ${totalImages} images, ${totalVideos} videos`;
+    // The server answers 503 when its thumbnail workers are saturated; try again a little later.
+    function retryThumbnail(event) {
+        const img = event.target;
+        const retries = Number(img.dataset.retries);
+        if (retries >= 3 || img.classList.contains('lazy')) return;
+        img.dataset.retries = retries + 1;
+        setTimeout(() => {
+            if (!img.classList.contains('lazy')) {
+                img.src = `${img.dataset.src}&retry=${retries + 1}`;
             }
+        }, 1000 * (retries + 1));
+    }
 
-            // --- Group images by month ---
-            const imagesByMonth = allImages.reduce((acc, image) => {
-                const date = new Date(image.mtime * 1000);
-                const key = `${date.getFullYear()}-${String(date.getMonth() + 1).padStart(2, '0')}`;
-                if (!acc[key]) {
-                    acc[key] = [];
-                }
-                acc[key].push(image);
-                return acc;
-            }, {});
+    // --- Incremental rendering state ---
+    let currentMonth = null;
+    let totalImages = 0, totalVideos = 0;
 
-            // --- Render grid with separators ---
-            for (const monthKey in imagesByMonth) {
-                const monthImages = imagesByMonth[monthKey];
-                const firstImageDate = new Date(monthImages[0].mtime * 1000);
-                const monthName = firstImageDate.toLocaleString('default', { month: 'long' });
-                const year = firstImageDate.getFullYear();
+    function updateStats() {
+        if (galleryStats) {
+            galleryStats.textContent = `Total: ${totalImages} images, ${totalVideos} videos`;
+        }
+    }
 
-                const monthImageCount = monthImages.filter(m => m.type === 'image').length;
-                const monthVideoCount = monthImages.filter(m => m.type === 'video').length;
+    function updateSeparator(month) {
+        month.countSpan.textContent = `(${month.images} images, ${month.videos} videos)`;
+    }
 
+    // Appends a batch of media items (already sorted newest first) to the grid,
+    // starting a new month separator whenever the month changes.
+    function appendMedia(items) {
+        const fragment = document.createDocumentFragment();
+        items.forEach(imageObject => {
+            const index = allImages.push(imageObject) - 1;
+            const date = new Date((imageObject[sortKey] || imageObject.mtime) * 1000);
+            const key = `${date.getFullYear()}-${String(date.getMonth() + 1).padStart(2, '0')}`;
+
+            if (!currentMonth || currentMonth.key !== key) {
+                if (currentMonth) updateSeparator(currentMonth);
+                const monthName = date.toLocaleString('default', { month: 'long' });
                 const separator = document.createElement('h2');
                 separator.className = 'gallery-date-separator';
-                separator.innerHTML = `${year} ${monthName} <span class="separator-count">(${monthImageCount} images, ${monthVideoCount} videos)</span>`;
-                galleryGrid.appendChild(separator);
+                separator.innerHTML = `${date.getFullYear()} ${monthName} <span class="separator-count"></span>`;
+                fragment.appendChild(separator);
+                currentMonth = { key, images: 0, videos: 0, countSpan: separator.querySelector('.separator-count') };
+            }
+
+            if (imageObject.type === 'video') {
+                currentMonth.videos++;
+                totalVideos++;
+            } else {
+                currentMonth.images++;
+                totalImages++;
+            }
 
-                monthImages.forEach(imageObject => {
-                    const itemWrapper = document.createElement('div');
-                    itemWrapper.className = 'grid-item-wrapper';
+            const itemWrapper = document.createElement('div');
+            itemWrapper.className = 'grid-item-wrapper';
 
-                    const img = document.createElement('img');
-                    img.dataset.index = allImages.indexOf(imageObject);
-                    img.classList.add('lazy');
+            const img = document.createElement('img');
+            img.dataset.index = index;
+            img.classList.add('lazy');
 
-                    if (imageObject.type === 'video') {
-                        const videoIcon = document.createElement('span');
-                        videoIcon.className = 'media-type-icon';
-                        videoIcon.textContent = '▶';
-                        itemWrapper.appendChild(videoIcon);
-                        itemWrapper.classList.add('video-item');
-                    }
+            if (imageObject.type === 'video') {
+                const videoIcon = document.createElement('span');
+                videoIcon.className = 'media-type-icon';
+                videoIcon.textContent = '▶';
+                itemWrapper.appendChild(videoIcon);
+                itemWrapper.classList.add('video-item');
+            }
 
-                    const thumbnailUrl = imageObject.src.replace('/image/', '/api/thumbnail/');
-                    img.dataset.src = thumbnailUrl;
-                    img.src = "data:image/gif;base64,R0lGODlhAQABAIAAAAAAAP///yH5BAEAAAAALAAAAAABAAEAAAIBRAA7";
+            // src already carries the ?v= version, so thumbnails are cached as immutable too.
+            const thumbnailUrl = `${imageObject.src.replace('/image/', '/api/thumbnail/')}&size=${thumbnailSize}`;
+            img.dataset.src = thumbnailUrl;
+            img.dataset.retries = 0;
+            img.addEventListener('error', retryThumbnail);
+            img.src = "data:image/gif;base64,R0lGODlhAQABAIAAAAAAAP///yH5BAEAAAAALAAAAAABAAEAAAIBRAA7";
 
-                    itemWrapper.appendChild(img);
-                    galleryGrid.appendChild(itemWrapper);
-                    imageObserver.observe(img);
-                });
+            itemWrapper.appendChild(img);
+            fragment.appendChild(itemWrapper);
+            imageObserver.observe(img);
+        });
+        if (currentMonth) updateSeparator(currentMonth);
+        galleryGrid.appendChild(fragment);
+        updateStats();
+    }
+
+    // Rebuilds item objects from a format=columns page (one array per field).
+    function decodeColumns(page) {
+        const items = new Array(page.count);
+        for (let i = 0; i < page.count; i++) {
+            const encodedPath = page.encoded_path[i];
+            items[i] = {
+                src: `/image/${encodedPath}?v=${page.version[i]}`,
+                filename: page.filename[i],
+                encoded_path: encodedPath,
+                mtime: page.mtime[i],
+                taken: page.taken[i],
+                type: page.types[page.type[i]]
+            };
+        }
+        return items;
+    }
+
+    async function loadImages() {
+        try {
+            allImages = [];
+            currentMonth = null;
+            totalImages = 0;
+            totalVideos = 0;
+            galleryGrid.innerHTML = ''; // Clear previous content
+
+            // Page through the listing in the compact columnar format: a small
+            // first page renders the first screenful quickly, larger ones follow.
+            let limit = 500;
+            let cursor = null;
+            do {
+                let url = `/api/images?format=columns&sort=${sortKey}&limit=${limit}`;
+                if (cursor) url += `&cursor=${encodeURIComponent(cursor)}`;
+                const response = await fetch(url);
+                if (!response.ok) throw new Error('Failed to load images.');
+                const page = await response.json();
+                appendMedia(decodeColumns(page));
+                cursor = page.next_cursor;
+                limit = 5000;
+            } while (cursor);
+
+            if (allImages.length === 0) {
+                galleryGrid.innerHTML = '<p>No images found in your collections.</p>';
             }
         } catch (error) {
             galleryGrid.innerHTML = `<p class="error">Error: ${error.message}</p>`;
@@ -269,18 +339,21 @@ document.addEventListener('DOMContentLoaded', () => {
         });
     }
 
-    async function loadAndDisplayMetadata() {
+    async function loadAndDisplayMetadata(attempt = 0) {
         const currentImage = allImages[currentIndex];
         if (!currentImage) return;
 
-        // Clear previous controls except for buttons
-        controlsPanel.querySelectorAll('.modal-info-panel').forEach(el => el.remove());
+        let infoPanel = attempt > 0 ? controlsPanel.querySelector('.modal-info-panel') : null;
+        if (!infoPanel) {
+            // Clear previous controls except for buttons
+            controlsPanel.querySelectorAll('.modal-info-panel').forEach(el => el.remove());
 
-        // Create a placeholder
-        const infoPanel = document.createElement('div');
-        infoPanel.className = 'modal-info-panel';
-        infoPanel.innerHTML = `<span>${currentImage.filename}</span><span>Loading details...</span>`;
-        controlsPanel.insertBefore(infoPanel, controlsPanel.firstChild);
+            // Create a placeholder
+            infoPanel = document.createElement('div');
+            infoPanel.className = 'modal-info-panel';
+            infoPanel.innerHTML = `<span>${currentImage.filename}</span><span>Loading details...</span>`;
+            controlsPanel.insertBefore(infoPanel, controlsPanel.firstChild);
+        }
 
         try {
             const response = await fetch(`/api/metadata/${currentImage.encoded_path}`);
@@ -295,6 +368,8 @@ document.addEventListener('DOMContentLoaded', () => {
             // Only show the second line for images
             if (currentImage.type === 'image') {
                 infoHtml += `<span>${metadata.model || 'N/A'} | ${metadata.location || 'No Location'} <button class="details-btn">Details</button></span>`;
+            } else if (metadata.duration) {
+                infoHtml += `<span>${formatDuration(metadata.duration)} | ${metadata.codec || 'N/A'} | ${metadata.fps ? `${Math.round(metadata.fps)} fps` : 'N/A'}</span>`;
             }
             infoPanel.innerHTML = infoHtml;
 
@@ -302,11 +377,28 @@ document.addEventListener('DOMContentLoaded', () => {
             if (detailsBtn) {
                 detailsBtn.addEventListener('click', () => showExifDetails(currentImage.encoded_path));
             }
+
+            // The address is looked up in the background; ask again until it arrives.
+            if (metadata.location_status === 'pending' && attempt < 15) {
+                setTimeout(() => {
+                    if (modal.style.display !== 'none' && allImages[currentIndex] === currentImage) {
+                        loadAndDisplayMetadata(attempt + 1);
+                    }
+                }, 2000);
+            }
         } catch (error) {
             infoPanel.innerHTML = `<span>${currentImage.filename}</span><span>Could not load details.</span>`;
         }
     }
 
+    function formatDuration(seconds) {
+        const total = Math.round(seconds);
+        const h = Math.floor(total / 3600);
+        const m = Math.floor((total % 3600) / 60);
+        const s = String(total % 60).padStart(2, '0');
+        return h ? `${h}:${String(m).padStart(2, '0')}:${s}` : `${m}:${s}`;
+    }
+
     async function showExifDetails(encodedPath) {
         const overlay = document.createElement('div');
         overlay.className = 'exif-overlay';
@@ -382,12 +474,15 @@ document.addEventListener('DOMContentLoaded', () => {
         const response = await fetch('/api/settings');
         const settings = await response.json();
         updateGridSize(settings.gallery_grid_size);
+        thumbnailSize = thumbnailBucket(settings.gallery_grid_size);
+        sortKey = settings.gallery_sort === 'taken' ? 'taken' : 'mtime';
     }
 
     if (galleryGrid) {
-        // Apply settings from server
-        applySettings();
-        loadImages();
+        // Apply settings from server first so thumbnails are requested at the right size
+        applySettings()
+            .catch(error => console.error('Failed to load settings:', error))
+            .then(loadImages);
     }
 
     // Memory cleanup when navigating away from the gallery page
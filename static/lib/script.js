@@ -11,13 +11,16 @@ document.addEventListener('DOMContentLoaded', () => {
     const pathDisplay = document.querySelector('.current-path-display');
     const directoryList = document.querySelector('.directory-list');
     const showHiddenToggle = document.getElementById('show-hidden-toggle');
+    const includeSubfoldersToggle = document.getElementById('include-subfolders-toggle');
     const driveSelector = document.getElementById('drive-selector');
 
     // Settings elements
     const gridSizeSlider = document.getElementById('grid-size-slider');
     const gridSizeValue = document.getElementById('grid-size-value');
+    const gallerySortSelect = document.getElementById('gallery-sort-select');
 
     let currentPath = null;
+    let browseToken = 0; // Bumped on every navigation so stale count updates are dropped
 
     // Create a single thumbnail preview element to be reused
     const thumbnailPreview = document.createElement('div');
@@ -26,7 +29,52 @@ document.addEventListener('DOMContentLoaded', () => {
 
     // --- Folder Browser Logic ---
 
+    function renderDirCounts(wrapper, dir) {
+        if (dir.pending) {
+            wrapper.innerHTML = `<span class="media-count pending-count" title="Counting...">…</span>`;
+            return;
+        }
+        let countsHtml = '';
+        if (dir.image_count > 0) {
+            countsHtml += `<span class="media-count image-count">${dir.image_count}</span>`;
+        }
+        if (dir.video_count > 0) {
+            countsHtml += `<span class="media-count video-count">${dir.video_count}</span>`;
+        }
+        wrapper.innerHTML = countsHtml;
+    }
+
+    // Subfolders the server could not count within its time budget are
+    // fetched afterwards, a batch at a time, until all are known.
+    async function fillPendingCounts(path, wrappers, token) {
+        let pending = Object.keys(wrappers);
+        while (pending.length > 0 && token === browseToken) {
+            let data;
+            try {
+                const response = await fetch('/api/browse/counts', {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json' },
+                    body: JSON.stringify({ path: path, names: pending }),
+                });
+                if (!response.ok) return;
+                data = await response.json();
+            } catch (error) {
+                return;
+            }
+            if (token !== browseToken) return;
+            pending = [];
+            data.directories.forEach(dir => {
+                if (dir.pending) {
+                    pending.push(dir.name);
+                } else if (wrappers[dir.name]) {
+                    renderDirCounts(wrappers[dir.name], dir);
+                }
+            });
+        }
+    }
+
     async function browse(path = null) {
+        const token = ++browseToken;
         try {
             directoryList.innerHTML = `<li>Loading...</li>`;
             const showHidden = showHiddenToggle.checked;
@@ -38,6 +86,7 @@ document.addEventListener('DOMContentLoaded', () => {
             if (!response.ok) throw new Error('Server error.');
             
             const data = await response.json();
+            if (token !== browseToken) return; // The user already navigated elsewhere
             currentPath = data.current_path;
             
             // Update path display with media counts
@@ -72,21 +121,15 @@ document.addEventListener('DOMContentLoaded', () => {
                 directoryList.appendChild(parentItem);
             }
 
+            const pendingWrappers = {};
             data.directories.forEach(dir => {
                 const item = document.createElement('li');
                 const dirName = dir.name;
-                const imageCount = dir.image_count;
-                const videoCount = dir.video_count;
-
-                let countsHtml = '';
-                if (imageCount > 0) {
-                    countsHtml += `<span class="media-count image-count">${imageCount}</span>`;
-                }
-                if (videoCount > 0) {
-                    countsHtml += `<span class="media-count video-count">${videoCount}</span>`;
-                }
 
-                item.innerHTML = `${dirName} <span class="counts-wrapper">${countsHtml}</span>`;
+                item.innerHTML = `${dirName} <span class="counts-wrapper"></span>`;
+                const wrapper = item.querySelector('.counts-wrapper');
+                renderDirCounts(wrapper, dir);
+                if (dir.pending) pendingWrappers[dirName] = wrapper;
                 item.dataset.path = `${currentPath}${currentPath.endsWith('\\') || currentPath.endsWith('/') ? '' : '\\'}${dirName}`;
                 directoryList.appendChild(item);
             });
@@ -115,6 +158,9 @@ document.addEventListener('DOMContentLoaded', () => {
 
                 directoryList.appendChild(item);
             });
+            if (data.pending_count > 0) {
+                fillPendingCounts(currentPath, pendingWrappers, token);
+            }
         } catch (error) {
             directoryList.innerHTML = `<li class="error">Error: ${error.message}</li>`;
         }
@@ -205,7 +251,7 @@ document.addEventListener('DOMContentLoaded', () => {
 
     selectFolderBtn.addEventListener('click', async () => {
         if (!currentPath) return;
-        await addFolder(currentPath);
+        await addFolder(currentPath, includeSubfoldersToggle.checked);
         modal.style.display = 'none';
     });
 
@@ -231,17 +277,18 @@ document.addEventListener('DOMContentLoaded', () => {
         }, 5000); // Toast disappears after 5 seconds
     }
 
-    async function addFolder(path) {
+    async function addFolder(path, recursive = false) {
         try {
             const response = await fetch('/api/add_folder', {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ path: path }),
+                body: JSON.stringify({ path: path, recursive: recursive }),
             });
             const result = await response.json();
             if (result.success) {
                 showToast(`Successfully added: ${result.path}`, 'success');
                 loadFolders();
+                waitForScan();
             } else {
                 throw new Error(result.error);
             }
@@ -250,6 +297,21 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
+    // Folders are indexed in the background; refresh the list once the scanner catches up.
+    async function waitForScan() {
+        try {
+            const response = await fetch('/api/scan_status');
+            const status = await response.json();
+            if (status.pending.length > 0 || status.current_folder) {
+                setTimeout(waitForScan, 2000);
+            } else {
+                loadFolders();
+            }
+        } catch (error) {
+            console.error('Failed to load scan status:', error);
+        }
+    }
+
     async function deleteFolder(path) {
         try {
             const response = await fetch('/api/delete_folder', {
@@ -288,8 +350,8 @@ document.addEventListener('DOMContentLoaded', () => {
                     const dateString = date.toLocaleDateString();
 
                     const textSpan = `<span>
-                        <strong>${folder.path}</strong><br>
-                        <small>Added: ${dateString} | Total Media: ${folder.media_count}</small>
+                        <strong>${folder.path}</strong>${folder.recursive ? ' <small>(incl. subfolders)</small>' : ''}<br>
+                        <small>Added: ${dateString} | Total Media: ${folder.scanned ? folder.media_count : 'Scanning...'}</small>
                     </span>`;
                     const deleteBtn = `<button class="delete-btn" title="Remove folder">🗑️</button>`;
                     item.innerHTML = textSpan + deleteBtn;
@@ -321,6 +383,9 @@ document.addEventListener('DOMContentLoaded', () => {
                 gridSizeSlider.value = settings.gallery_grid_size;
                 gridSizeValue.textContent = `${settings.gallery_grid_size}px`;
             }
+            if (gallerySortSelect) {
+                gallerySortSelect.value = settings.gallery_sort;
+            }
         } catch (error) {
             console.error('Failed to load settings:', error);
         }
@@ -346,6 +411,12 @@ document.addEventListener('DOMContentLoaded', () => {
         });
     }
 
+    if (gallerySortSelect) {
+        gallerySortSelect.addEventListener('change', (e) => {
+            saveSetting('gallery_sort', e.target.value);
+        });
+    }
+
     // Initial Loads
     loadSettings();
     loadFolders();
@@ -0,0 +1,373 @@
+import os
+import io
+import math
+import hashlib
+import threading
+from collections import OrderedDict
+from PIL import Image, ImageOps
+from video import probe_video, encode_poster, read_poster
+from metrics import stage
+
+try:
+    import pillow_avif # noqa: F401 -- optional plugin that registers an AVIF encoder on older Pillow
+except ImportError:
+    pass
+
+THUMB_CACHE_DIR = os.path.join('cache', 'thumbnails')
+VIDEO_EXTS = ('.mp4', '.webm', '.mov', '.avi', '.mkv')
+# Thumbnails are rendered at one of these bounding-box sizes (px) so a handful
+# of cached variants serve every grid size and pixel density.
+SIZE_BUCKETS = (128, 256, 512, 1024)
+# Output format -> (mimetype, file extension, Pillow save options)
+FORMATS = {
+    'avif': ('image/avif', 'avif', {'quality': 60, 'speed': 8}),
+    'webp': ('image/webp', 'webp', {'quality': 75, 'method': 4}),
+    'jpeg': ('image/jpeg', 'jpg', {'quality': 80}),
+}
+AVIF_AVAILABLE = 'AVIF' in Image.SAVE
+
+
+def is_video(path):
+    return path.lower().endswith(VIDEO_EXTS)
+
+
+def size_bucket(requested):
+    """Returns the smallest bucket that covers `requested` px (capped at the largest)."""
+    for bucket in SIZE_BUCKETS:
+        if bucket >= requested:
+            return bucket
+    return SIZE_BUCKETS[-1]
+
+
+def negotiate_format(accepted):
+    """Picks the most compact format the client explicitly accepts.
+
+    `accepted` is the collection of mimetypes listed in the Accept header;
+    wildcards are ignored so that only clients that advertise WebP/AVIF get it.
+    """
+    if AVIF_AVAILABLE and 'image/avif' in accepted:
+        return 'avif'
+    if 'image/webp' in accepted:
+        return 'webp'
+    return 'jpeg'
+
+
+# EXIF orientation -> the transpose that undoes it (mirrors ImageOps.exif_transpose).
+ORIENTATION_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+EXIF_ORIENTATION = 0x0112
+EXIF_THUMB_OFFSET = 0x0201
+EXIF_THUMB_LENGTH = 0x0202
+
+
+def _embedded_thumbnail(img, exif, size):
+    """Returns the JPEG's embedded EXIF thumbnail if it covers `size` with the same aspect ratio."""
+    raw = img.info.get('exif')
+    if not raw or not raw.startswith(b'Exif\x00\x00'):
+        return None
+    try:
+        ifd1 = exif.get_ifd(-1) # IFD1 holds the thumbnail; offsets are relative to the TIFF header
+        offset, length = ifd1.get(EXIF_THUMB_OFFSET), ifd1.get(EXIF_THUMB_LENGTH)
+        if not offset or not length:
+            return None
+        data = raw[6 + offset:6 + offset + length]
+        thumb = Image.open(io.BytesIO(data))
+        thumb.load()
+    except Exception:
+        return None
+    scale = min(size[0] / img.width, size[1] / img.height, 1)
+    fits = thumb.width >= round(img.width * scale) and thumb.height >= round(img.height * scale)
+    same_aspect = abs(thumb.width / thumb.height - img.width / img.height) < 0.02
+    return thumb if fits and same_aspect else None
+
+
+def open_image_for_thumbnail(path, size):
+    """Opens an image already upright and as small as possible while still covering `size`.
+
+    For JPEGs, an embedded EXIF thumbnail is used outright when it is large
+    enough; otherwise libjpeg is asked (via Image.draft) to decode at the
+    smallest 1/2, 1/4 or 1/8 scale that still covers the target, instead of
+    decoding the full 24-50 MP frame and throwing most of it away.
+    """
+    with Image.open(path) as img:
+        if img.format != 'JPEG':
+            return ImageOps.exif_transpose(img)
+
+        exif = img.getexif()
+        orientation = exif.get(EXIF_ORIENTATION)
+        box = size
+        if orientation in (5, 6, 7, 8):
+            box = (size[1], size[0]) # Rotated by 90 degrees once made upright
+
+        embedded = _embedded_thumbnail(img, exif, box)
+        if embedded is not None:
+            method = ORIENTATION_TRANSPOSE.get(orientation)
+            return embedded.transpose(method) if method is not None else embedded
+
+        scale = min(box[0] / img.width, box[1] / img.height)
+        if scale < 1:
+            img.draft(img.mode, (math.ceil(img.width * scale), math.ceil(img.height * scale)))
+        # exif_transpose loads the (now reduced) image and always returns a new one.
+        return ImageOps.exif_transpose(img)
+
+
+def render_thumbnail(img, size, fmt):
+    """Downscales an image to fit a size x size box and encodes it as `fmt` (one of FORMATS)."""
+    with stage('resize'):
+        img.thumbnail((size, size)) # In place; preserves aspect ratio
+        # Flatten transparency, palettes and CMYK so every output format can encode it
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+    with stage('encode'):
+        img_io = io.BytesIO()
+        img.save(img_io, fmt.upper(), **FORMATS[fmt][2])
+    return img_io.getvalue()
+
+
+def generate_thumbnail(path, size=512, fmt='jpeg'):
+    """Decodes a media file and returns a thumbnail fitting a size x size box, or None.
+
+    `fmt` is one of FORMATS; the result is encoded bytes in that format.
+    """
+    if is_video(path):
+        with stage('video_probe'):
+            img = probe_video(path)[1]
+    else:
+        with stage('decode'):
+            img = open_image_for_thumbnail(path, (size, size))
+    if img is None:
+        return None
+    return render_thumbnail(img, size, fmt)
+
+
+def thumbnail_name(path, st, size, fmt):
+    """Returns the cache entry name for one size/format variant of a file's thumbnail."""
+    return f'{ThumbnailCache.make_key(path, st, f"{size}.{fmt}")}.{FORMATS[fmt][1]}'
+
+
+def cache_file_path(cache_dir, name):
+    return os.path.join(cache_dir, name[:2], name)
+
+
+def write_atomic(file_path, data):
+    """Writes a cache file via a temp file so readers never see a partial entry."""
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    tmp_path = f'{file_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, file_path)
+
+
+def poster_name(path, st):
+    """Returns the cache entry name of a video's poster frame."""
+    return thumbnail_name(path, st, 'poster', 'jpeg')
+
+
+def video_poster(path, st, cache_dir):
+    """Returns (poster, info, written) for a video, opening the container only on a cache miss.
+
+    `info` is the VideoInfo when the file had to be probed (None when the
+    poster came from the cache) and `written` lists the new cache entry as
+    (name, size), for the caller to register.
+    """
+    name = poster_name(path, st)
+    file_path = cache_file_path(cache_dir, name)
+    poster = read_poster(file_path) if os.path.exists(file_path) else None
+    if poster is not None:
+        return poster, None, []
+    with stage('video_probe'):
+        info, poster = probe_video(path)
+    if poster is None:
+        return None, info, []
+    data = encode_poster(poster)
+    write_atomic(file_path, data)
+    return poster, info, [(name, len(data))]
+
+
+def render_video_thumbnail(path, cache_dir, size, fmt):
+    """Worker-process entry point: cuts one thumbnail from a video's cached poster.
+
+    Returns (data, probe, written): the encoded thumbnail (or None), the
+    (mtime, size, VideoInfo) probe result if the file had to be opened, and
+    the new poster cache entry, if any.
+    """
+    st = os.stat(path)
+    poster, info, written = video_poster(path, st, cache_dir)
+    data = render_thumbnail(poster, size, fmt) if poster is not None else None
+    return data, (st.st_mtime, st.st_size, info) if info is not None else None, written
+
+
+def probe_video_cached(path, cache_dir):
+    """Worker-process entry point: probes a video and caches its poster on the way.
+
+    Returns (probe, written) like render_video_thumbnail.
+    """
+    st = os.stat(path)
+    with stage('video_probe'):
+        info, poster = probe_video(path)
+    written = []
+    if poster is not None:
+        name = poster_name(path, st)
+        data = encode_poster(poster)
+        write_atomic(cache_file_path(cache_dir, name), data)
+        written.append((name, len(data)))
+    return (st.st_mtime, st.st_size, info) if info is not None else None, written
+
+
+def warm_thumbnail(path, cache_dir, variants):
+    """Worker-process entry point: renders thumbnail variants straight into the cache.
+
+    `variants` is a list of (size, fmt) pairs. Returns (written, probe):
+    the (name, size) of every entry written, for the parent to register, and
+    for videos that had to be opened the (mtime, size, VideoInfo) probe
+    result to store. Variants that already existed or could not be decoded
+    are left out.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return [], None
+    missing = []
+    for size, fmt in variants:
+        name = thumbnail_name(path, st, size, fmt)
+        file_path = cache_file_path(cache_dir, name)
+        if not os.path.exists(file_path):
+            missing.append((size, fmt, name, file_path))
+    if not missing:
+        return [], None
+
+    written = []
+    probe = None
+    poster = None
+    if is_video(path):
+        # Every variant is cut from the one cached poster frame.
+        poster, info, written = video_poster(path, st, cache_dir)
+        if info is not None:
+            probe = (st.st_mtime, st.st_size, info)
+        if poster is None:
+            return written, probe
+    for size, fmt, name, file_path in missing:
+        if poster is not None:
+            data = render_thumbnail(poster.copy(), size, fmt)
+        else:
+            data = generate_thumbnail(path, size, fmt)
+        if data is None:
+            break
+        write_atomic(file_path, data)
+        written.append((name, len(data)))
+    return written, probe
+
+
+class ThumbnailCache:
+    """A persistent thumbnail store under cache/ with a size cap and LRU eviction.
+
+    Entries are keyed by the source path, mtime and size, so editing a file
+    simply produces a new key and the stale entry ages out of the cache.
+    """
+
+    def __init__(self, cache_dir=THUMB_CACHE_DIR, max_bytes=1024 * 1024 * 1024):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict() # name -> size, least recently used first
+        self._total_bytes = 0
+        self._loaded = False
+
+    @staticmethod
+    def make_key(path, st, variant=''):
+        """Builds a cache key (also used as the ETag) from a file's path and stat result."""
+        raw = f'{path}|{st.st_mtime_ns}|{st.st_size}|{variant}'
+        return hashlib.sha1(raw.encode('utf-8', 'surrogateescape')).hexdigest()
+
+    def _file_path(self, name):
+        return cache_file_path(self.cache_dir, name)
+
+    def _ensure_loaded(self):
+        """Indexes existing cache files once, oldest access first."""
+        if self._loaded:
+            return
+        found = []
+        if os.path.isdir(self.cache_dir):
+            for bucket in os.scandir(self.cache_dir):
+                if not bucket.is_dir():
+                    continue
+                for entry in os.scandir(bucket.path):
+                    try:
+                        if entry.name.endswith('.tmp'):
+                            os.remove(entry.path) # Leftover from an interrupted write
+                            continue
+                        st = entry.stat()
+                        found.append((st.st_mtime, entry.name, st.st_size))
+                    except OSError:
+                        continue
+        found.sort()
+        for _, name, size in found:
+            self._entries[name] = size
+            self._total_bytes += size
+        self._loaded = True
+
+    def load(self):
+        """Indexes the cache folder now instead of on the first lookup."""
+        with self._lock:
+            self._ensure_loaded()
+
+    def get(self, name):
+        """Returns the on-disk path of a cached entry, or None on a miss."""
+        with self._lock:
+            self._ensure_loaded()
+            if name not in self._entries:
+                return None
+            self._entries.move_to_end(name)
+        file_path = self._file_path(name)
+        try:
+            # The file mtime doubles as the access time so LRU order survives restarts.
+            os.utime(file_path)
+        except OSError:
+            with self._lock:
+                size = self._entries.pop(name, None)
+                if size is not None:
+                    self._total_bytes -= size
+            return None
+        return file_path
+
+    def put(self, name, data):
+        """Atomically writes an entry to disk and evicts old entries over the cap."""
+        file_path = self._file_path(name)
+        write_atomic(file_path, data)
+        self.register(name, len(data))
+        return file_path
+
+    def register(self, name, size):
+        """Accounts for an entry written to disk by another process."""
+        with self._lock:
+            self._ensure_loaded()
+            self._total_bytes -= self._entries.pop(name, 0)
+            self._entries[name] = size
+            self._total_bytes += size
+            self._evict()
+
+    def _evict(self):
+        while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+            name, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            try:
+                os.remove(self._file_path(name))
+            except OSError:
+                pass
+
+    def set_max_bytes(self, max_bytes):
+        with self._lock:
+            self.max_bytes = max_bytes
+            if self._loaded:
+                self._evict()
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self._total_bytes, 'max_bytes': self.max_bytes}
@@ -0,0 +1,104 @@
+import io
+from collections import namedtuple
+from PIL import Image
+
+# Posters are kept at the largest thumbnail size so every bucket can be cut from them.
+POSTER_SIZE = 1024
+# Where to look for a poster frame, as fractions of the stream length. The
+# first frame is often black (fade-ins, camera start-up), so skip a little.
+POSTER_POSITIONS = (0.05, 0.15, 0.3, 0.5)
+# Frames whose mean brightness (0-255) is below this count as black.
+DARK_THRESHOLD = 20
+# Frames read one by one when the container doesn't report its length.
+SEQUENTIAL_SCAN_FRAMES = 90
+
+VideoInfo = namedtuple('VideoInfo', ['width', 'height', 'duration', 'fps', 'codec'])
+
+
+def decode_fourcc(value):
+    """Turns OpenCV's numeric FOURCC property into a codec name like 'avc1'."""
+    code = int(value)
+    name = ''.join(chr((code >> 8 * i) & 0xFF) for i in range(4))
+    return name.strip('\x00 ') or None
+
+
+def is_dark(frame):
+    # Every 8th pixel is plenty to judge overall brightness.
+    return frame[::8, ::8].mean() < DARK_THRESHOLD
+
+
+def _pick_frame(cap, frame_count):
+    """Returns the first non-black frame at POSTER_POSITIONS, or the best we could read."""
+    import cv2
+    fallback = None
+    if frame_count > 0:
+        for position in POSTER_POSITIONS:
+            # The FFmpeg backend seeks to the preceding keyframe and decodes forward from there.
+            cap.set(cv2.CAP_PROP_POS_FRAMES, int(frame_count * position))
+            ret, frame = cap.read()
+            if not ret:
+                continue
+            if not is_dark(frame):
+                return frame
+            if fallback is None:
+                fallback = frame
+        cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+    # Unknown length (some WebM/MKV files) or seeking failed: read from the start.
+    for _ in range(SEQUENTIAL_SCAN_FRAMES):
+        ret, frame = cap.read()
+        if not ret:
+            break
+        if not is_dark(frame):
+            return frame
+        if fallback is None:
+            fallback = frame
+    return fallback
+
+
+def probe_video(path, poster_size=POSTER_SIZE):
+    """Opens a video once and reads its stream properties and a poster frame.
+
+    Returns (VideoInfo, poster) where poster is a PIL image no larger than
+    poster_size, or (None, None) if the file can't be opened.
+    """
+    # OpenCV is imported on first use: loading it (and its bundled FFmpeg)
+    # takes seconds in the frozen executable and most requests never need it.
+    import cv2
+    cap = cv2.VideoCapture(path)
+    try:
+        if not cap.isOpened():
+            return None, None
+        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        fps = cap.get(cv2.CAP_PROP_FPS) or 0.0
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+        codec = decode_fourcc(cap.get(cv2.CAP_PROP_FOURCC))
+        frame = _pick_frame(cap, frame_count)
+    finally:
+        cap.release()
+
+    poster = None
+    if frame is not None:
+        # Decoded frames are already rotated, so their shape is what viewers see.
+        height, width = frame.shape[:2]
+        poster = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+        poster.thumbnail((poster_size, poster_size))
+    duration = frame_count / fps if fps > 0 and frame_count > 0 else None
+    return VideoInfo(width, height, duration, round(fps, 3) if fps > 0 else None, codec), poster
+
+
+def encode_poster(poster):
+    """Encodes a poster frame for the cache; thumbnails are re-encoded from it later."""
+    out = io.BytesIO()
+    poster.save(out, 'JPEG', quality=90)
+    return out.getvalue()
+
+
+def read_poster(file_path):
+    """Loads a cached poster, or returns None if it is missing or unreadable."""
+    try:
+        with Image.open(file_path) as img:
+            img.load()
+            return img
+    except OSError:
+        return None
@@ -0,0 +1,115 @@
+import os
+import fnmatch
+from collections import namedtuple
+from concurrent.futures import wait, FIRST_COMPLETED
+
+IMAGE_EXTS = ('.png', '.jpg', '.jpeg', '.gif', '.webp', '.bmp')
+VIDEO_EXTS = ('.mp4', '.webm', '.mov', '.avi', '.mkv')
+MEDIA_EXTS = IMAGE_EXTS + VIDEO_EXTS
+
+# dirs:   {dir_path: (parent_path, dir_mtime)} for every directory reached
+# listed: {dir_path: [MediaFile, ...]} for the directories that were actually re-read
+WalkResult = namedtuple('WalkResult', ['dirs', 'listed'])
+MediaFile = namedtuple('MediaFile', ['path', 'name', 'mtime', 'size', 'type'])
+
+
+def media_type(filename):
+    """Returns 'image', 'video' or None for a filename based on its extension."""
+    name = filename.lower()
+    if name.endswith(IMAGE_EXTS):
+        return 'image'
+    if name.endswith(VIDEO_EXTS):
+        return 'video'
+    return None
+
+
+def is_hidden(filename):
+    """Hidden/system entries (like ._ files from macOS) are never cataloged."""
+    return filename.startswith('.') or filename.startswith('$')
+
+
+def is_excluded(root, path, name, patterns):
+    """Matches exclude patterns against the entry name and its path relative to the root."""
+    if not patterns:
+        return False
+    rel_path = os.path.relpath(path, root).replace(os.sep, '/')
+    return any(fnmatch.fnmatch(name, p) or fnmatch.fnmatch(rel_path, p) for p in patterns)
+
+
+def _visit(root, dir_path, known, exclude, force):
+    """Reads one directory, or reuses what `known` says about it if its mtime is unchanged.
+
+    Returns (dir_mtime, files, subdirs); files is None for an unchanged directory.
+    """
+    dir_mtime = os.stat(dir_path).st_mtime
+    previous = known.get(dir_path)
+    if not force and previous is not None and previous[0] == dir_mtime:
+        return dir_mtime, None, previous[1]
+
+    files = []
+    subdirs = []
+    with os.scandir(dir_path) as it:
+        for entry in it:
+            if is_hidden(entry.name) or is_excluded(root, entry.path, entry.name, exclude):
+                continue
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                    continue
+                kind = media_type(entry.name)
+                if kind is None or not entry.is_file():
+                    continue
+                # DirEntry caches the stat result (free on Windows), so no extra getmtime calls.
+                st = entry.stat()
+            except OSError:
+                continue # Skip files that can't be processed
+            files.append(MediaFile(entry.path, entry.name, st.st_mtime, st.st_size, kind))
+    return dir_mtime, files, subdirs
+
+
+def walk_media(root, executor, max_depth=0, exclude=(), skip_dirs=(), known=None, force=False):
+    """Walks a folder tree in parallel, listing media files with os.scandir.
+
+    Directories are visited concurrently on `executor`, which hides the
+    per-call latency of network storage. `max_depth` limits recursion
+    (0 = only the root, None = unlimited) and `skip_dirs` prunes subtrees
+    that are indexed separately. `known` maps directories from a previous
+    walk to (dir_mtime, subdirs); unless `force` is set, unchanged
+    directories are not re-read, only stat'ed, and their recorded
+    subdirectories are visited instead.
+
+    Returns a WalkResult, or None if the root itself can't be read.
+    """
+    known = known or {}
+    skip_dirs = set(skip_dirs)
+    result = WalkResult({}, {})
+    try:
+        dir_mtime, files, subdirs = _visit(root, root, known, exclude, force)
+    except OSError:
+        return None
+
+    def collect(dir_path, parent, depth, dir_mtime, files, subdirs):
+        result.dirs[dir_path] = (parent, dir_mtime)
+        if files is not None:
+            result.listed[dir_path] = files
+        if max_depth is not None and depth >= max_depth:
+            return
+        for sub in subdirs:
+            if sub not in skip_dirs:
+                future = executor.submit(_visit, root, sub, known, exclude, force)
+                pending[future] = (sub, dir_path, depth + 1)
+
+    pending = {}
+    collect(root, None, 0, dir_mtime, files, subdirs)
+    while pending:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            dir_path, parent, depth = pending.pop(future)
+            try:
+                collect(dir_path, parent, depth, *future.result())
+            except OSError:
+                previous = known.get(dir_path)
+                if previous is not None:
+                    # Transient failure (e.g. a network hiccup): keep what we knew.
+                    collect(dir_path, parent, depth, previous[0], None, previous[1])
+    return result
@@ -0,0 +1,164 @@
+import os
+import time
+import heapq
+import threading
+import logging
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from thumbnails import warm_thumbnail
+from metrics import run_with_stages, record_stages
+
+logger = logging.getLogger(__name__)
+
+
+class ThumbnailWarmer:
+    """Pre-generates thumbnails in a process pool, newest media first.
+
+    Pillow decoding is CPU bound and holds the GIL, so the work runs in
+    separate processes (one per core by default) rather than in the
+    server's threads. Work is queued per folder so that removing a
+    collection cancels everything still pending for it.
+    """
+
+    def __init__(self, cache, variants, max_workers=None, catalog=None):
+        self.cache = cache
+        self.catalog = catalog # Receives the video probe results found while rendering
+        self.variants = variants # (size, fmt) thumbnail variants to render for each file
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self._lock = threading.Lock()
+        self._queue = [] # heap of (-mtime, path, folder)
+        self._queued = set()
+        self._in_flight = {} # future -> (path, folder)
+        self._pool = None
+        self._thread = None
+        self._counts = {'done': 0, 'skipped': 0, 'failed': 0, 'cancelled': 0}
+
+    def enqueue(self, folder, items):
+        """Queues (path, mtime) pairs for a folder; newer files are rendered first."""
+        with self._lock:
+            in_flight = {path for path, _ in self._in_flight.values()}
+            for path, mtime in items:
+                if path not in self._queued and path not in in_flight:
+                    self._queued.add(path)
+                    heapq.heappush(self._queue, (-mtime, path, folder))
+            if self._queue and self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='ThumbnailWarmer', daemon=True)
+                self._thread.start()
+
+    def cancel_folder(self, folder):
+        """Drops queued work for a folder and cancels tasks that have not started yet."""
+        with self._lock:
+            remaining = [item for item in self._queue if item[2] != folder]
+            self._counts['cancelled'] += len(self._queue) - len(remaining)
+            self._queue = remaining
+            heapq.heapify(self._queue)
+            self._queued = {item[1] for item in self._queue}
+            for future, (_, future_folder) in self._in_flight.items():
+                if future_folder == folder:
+                    future.cancel()
+
+    def progress(self):
+        with self._lock:
+            by_folder = {}
+            for _, _, folder in self._queue:
+                by_folder[folder] = by_folder.get(folder, 0) + 1
+            return dict(self._counts, queued=len(self._queue), in_flight=len(self._in_flight),
+                        workers=self.max_workers, queued_by_folder=by_folder)
+
+    def _submit_next(self):
+        """Moves the newest queued item into the pool. Called with the lock held."""
+        _, path, folder = heapq.heappop(self._queue)
+        self._queued.discard(path)
+        args = (run_with_stages, warm_thumbnail, path, self.cache.cache_dir, list(self.variants))
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers)
+        try:
+            future = self._pool.submit(*args)
+        except (BrokenProcessPool, RuntimeError) as e:
+            # The pool broke or was shut down under us; retry once on a fresh one.
+            logger.warning('Thumbnail worker pool unusable (%s); starting a new one', e)
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers)
+            try:
+                future = self._pool.submit(*args)
+            except Exception:
+                self._counts['failed'] += 1
+                raise
+        self._in_flight[future] = (path, folder)
+
+    def _finish(self, future):
+        path, folder = self._in_flight.pop(future)
+        if future.cancelled():
+            self._counts['cancelled'] += 1
+            return
+        try:
+            (written, probe), stages = future.result()
+        except BrokenProcessPool:
+            # A worker died (e.g. a decoder crash on a corrupt file); start a fresh pool.
+            logger.warning('Thumbnail worker pool broke while rendering %s', path)
+            self._counts['failed'] += 1
+            if self._pool is not None:
+                self._pool.shutdown(wait=False) # Lets any tasks it still has finish
+                self._pool = None
+            return
+        except Exception as e:
+            logger.warning('Could not pre-generate thumbnail for %s: %s', path, e)
+            self._counts['failed'] += 1
+            return
+        record_stages(stages)
+        if probe is not None and self.catalog is not None:
+            self.catalog.put_video_info(path, *probe)
+        if not written:
+            self._counts['skipped'] += 1
+            return
+        for name, size in written:
+            self.cache.register(name, size)
+        self._counts['done'] += 1
+
+    def _run(self):
+        try:
+            while True:
+                try:
+                    if not self._step():
+                        return
+                except Exception:
+                    # Keep warming: log, drop the pool and carry on with the rest of the queue.
+                    logger.exception('Thumbnail pre-generation failed; restarting the worker pool')
+                    with self._lock:
+                        if self._pool is not None:
+                            self._pool.shutdown(wait=False)
+                            self._pool = None
+                    time.sleep(1)
+        finally:
+            with self._lock:
+                # Whatever happened, let enqueue() start a new thread.
+                if self._thread is threading.current_thread():
+                    self._thread = None
+
+    def _step(self):
+        """Fills the pool and handles the next finished tasks; returns False once idle."""
+        with self._lock:
+            # Keep only a couple of tasks per worker in the pool so priority
+            # order and cancellation still apply to everything else.
+            while self._queue and len(self._in_flight) < self.max_workers * 2:
+                self._submit_next()
+            if not self._in_flight:
+                # Idle: release the worker processes and let the thread exit;
+                # enqueue() starts a new one when more work arrives.
+                if self._pool is not None:
+                    self._pool.shutdown(wait=False)
+                    self._pool = None
+                self._thread = None
+                return False
+            futures = list(self._in_flight)
+        done, _ = wait(futures, return_when=FIRST_COMPLETED)
+        with self._lock:
+            for future in done:
+                self._finish(future)
+        return True
+
+    def join(self):
+        """Blocks until everything queued so far has been processed."""
+        with self._lock:
+            thread = self._thread
+        if thread is not None:
+            thread.join()
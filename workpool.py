@@ -0,0 +1,120 @@
+import os
+import time
+import threading
+import logging
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from metrics import run_with_stages, record_stages
+
+logger = logging.getLogger(__name__)
+
+
+class PoolBusy(Exception):
+    """Raised when the CPU pool is saturated; callers answer 503 with Retry-After."""
+
+
+class TaskTimeout(Exception):
+    """Raised when a task outlives the pool's task_timeout (e.g. a decoder hanging on a corrupt file)."""
+
+
+class CpuPool:
+    """A bounded process pool for the CPU-heavy part of request handling.
+
+    Thumbnail decodes, EXIF parsing and video probes run here instead of in
+    the server's threads, so they use every core and never hold the GIL
+    that the cheap JSON endpoints need. Admission is capped at
+    max_workers + queue_limit tasks: beyond that run() raises PoolBusy at
+    once instead of parking another server thread, which keeps threads
+    free for everything else.
+
+    A task still running after task_timeout seconds raises TaskTimeout
+    and gives its slot back; its worker can't be interrupted, so the pool
+    is replaced and the old one retired (see _reap).
+    """
+
+    def __init__(self, max_workers=None, queue_limit=None, task_timeout=60):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.task_timeout = task_timeout
+        self.queue_limit = self.max_workers if queue_limit is None else queue_limit
+        self._slots = threading.BoundedSemaphore(self.max_workers + self.queue_limit)
+        self._lock = threading.Lock()
+        self._pool = None
+        self._in_flight = 0
+        self._counts = {'completed': 0, 'failed': 0, 'rejected': 0, 'timed_out': 0}
+        self._busy_seconds = 0.0
+
+    def _executor(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.max_workers)
+            return self._pool
+
+    def _retire(self, pool):
+        with self._lock:
+            if self._pool is not pool:
+                return # Already replaced
+            self._pool = None
+        threading.Thread(target=self._reap, args=(pool,), name='cpu-pool-reaper', daemon=True).start()
+
+    def _reap(self, pool):
+        """Lets a retired pool finish its other tasks, then kills the workers still running."""
+        # No public way to reach the workers before Python 3.14.
+        processes = list((getattr(pool, '_processes', None) or {}).values())
+        pool.shutdown(wait=False)
+        # Any task still running by then has timed out for its caller as well.
+        time.sleep(self.task_timeout)
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+    def run(self, fn, *args):
+        """Runs fn(*args) in a worker process and returns its result; raises PoolBusy or TaskTimeout."""
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._counts['rejected'] += 1
+            raise PoolBusy()
+        with self._lock:
+            self._in_flight += 1
+        started = time.perf_counter()
+        outcome = 'failed'
+        try:
+            pool = self._executor()
+            try:
+                result, stages = pool.submit(run_with_stages, fn, *args).result(timeout=self.task_timeout)
+            except FutureTimeout:
+                logger.warning('%s took over %s s on %s; replacing the CPU worker pool',
+                               getattr(fn, '__name__', fn), self.task_timeout, args[0] if args else None)
+                self._retire(pool)
+                outcome = 'timed_out'
+                raise TaskTimeout()
+            except BrokenProcessPool:
+                # A worker crashed (e.g. a decoder segfault); start fresh for the next task.
+                logger.warning('CPU worker pool broke while running %s', getattr(fn, '__name__', fn))
+                with self._lock:
+                    self._pool = None
+                raise
+            outcome = 'completed'
+            record_stages(stages) # Decode/encode timings measured inside the worker
+            return result
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+                self._counts[outcome] += 1
+                self._busy_seconds += time.perf_counter() - started
+            self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            finished = self._counts['completed'] + self._counts['failed'] + self._counts['timed_out']
+            return dict(self._counts,
+                        workers=self.max_workers,
+                        queue_limit=self.queue_limit,
+                        in_flight=self._in_flight,
+                        queued=max(0, self._in_flight - self.max_workers),
+                        avg_task_ms=self._busy_seconds * 1000 / finished if finished else None)
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None